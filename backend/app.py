@@ -1,15 +1,26 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template, send_file, abort
+from flask import Flask, request, jsonify, send_from_directory, render_template, send_file, abort, Response, stream_with_context
 import os
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import jwt
 from functools import wraps
 import requests
 from dotenv import load_dotenv
 import time  # 导入 time 模块用于时间戳
-import codecs
 import json
-from .models import db, PDFBook, Conversation, Message, Bookmark, Note, WorkRecord, Game, AIConfig  # 更新导入
+import re
+from urllib.parse import unquote
+from bisect import bisect_right
+import click
+from sqlalchemy import tuple_
+from sqlalchemy.orm import load_only
+from PIL import UnidentifiedImageError
+from .models import db, PDFBook, BookChapter, Conversation, Message, Bookmark, Note, WorkRecord, Game, AIConfig, UploadSession, Job, NoteRevision  # 更新导入
+from . import txt_utils, pdf_utils, search, images, storage, uploads, jobs, notes, revisions, note_buffer, qwen_client, chat_context
+from .http_cache import send_cached_file
+from .image_cache import ImageCache, MAX_DIMENSION
+from .response_cache import ResponseCache, make_key
+from werkzeug.security import safe_join
 from flask_migrate import Migrate  # 新增导入
 
 # 加载环境变量
@@ -29,21 +40,50 @@ app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
 app.config['PDF_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'pdfs')
 app.config['IMAGE_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'images')
 app.config['GAME_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'games')
+app.config['COVER_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'covers')
+app.config['BLOB_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'blobs')  # 内容寻址存储
+app.config['IMAGE_CACHE_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'cache', 'img')  # 缩放图片缓存
+app.config['IMAGE_CACHE_MAX_BYTES'] = 512 * 1024 * 1024
 app.config['SECRET_KEY'] = 'your-secret-key-here' 
+# 备忘录图片压缩后是否保留原图
+app.config['KEEP_ORIGINAL_IMAGES'] = os.getenv('KEEP_ORIGINAL_IMAGES', 'false').lower() == 'true'
+# 备忘录自动保存先写入内存缓冲，定时合并写入数据库（只适合单进程部署）
+app.config['NOTE_WRITE_BEHIND'] = os.getenv('NOTE_WRITE_BEHIND', 'false').lower() == 'true'
+app.config['NOTE_FLUSH_SECONDS'] = 10
+# AI 对话每次发送的历史上下文（含滚动摘要）的估算 token 上限
+app.config['CHAT_CONTEXT_TOKENS'] = int(os.getenv('CHAT_CONTEXT_TOKENS', '3000'))
+# AI 回复缓存（同一 API Key 下相同的模型、消息和温度直接返回缓存的回复）；设置 QWEN_CACHE_DB 时同时保存到该 SQLite 文件
+app.config['QWEN_CACHE_MAX_ENTRIES'] = 500
+app.config['QWEN_CACHE_TTL_SECONDS'] = 24 * 3600
+app.config['QWEN_CACHE_DB'] = os.getenv('QWEN_CACHE_DB') or None
 
 # 创建上传目录
 os.makedirs(app.config['PDF_FOLDER'], exist_ok=True)
 os.makedirs(app.config['IMAGE_FOLDER'], exist_ok=True)
 os.makedirs(app.config['GAME_FOLDER'], exist_ok=True)
+os.makedirs(app.config['COVER_FOLDER'], exist_ok=True)
+os.makedirs(app.config['BLOB_FOLDER'], exist_ok=True)
+os.makedirs(app.config['IMAGE_CACHE_FOLDER'], exist_ok=True)
 
 # 初始化数据库（只需要一次）
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///freework.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
 
+# 无人引用文件的回收间隔
+GC_INTERVAL_SECONDS = 6 * 3600
+# 备忘录旧版本的清理间隔
+REVISION_THIN_INTERVAL_SECONDS = 24 * 3600
+
 # 初始化迁移工具
 migrate = Migrate(app, db)
 
+# 后台任务线程池（上传后的索引、定期回收无人引用的文件等）
+jobs.init_app(app)
+jobs.every('gc_uploads', GC_INTERVAL_SECONDS)
+jobs.every('thin_note_revisions', REVISION_THIN_INTERVAL_SECONDS)
+note_buffer.init_app(app)
+
 # 上传文档接口 (支持 PDF/TXT)
 # 修改上传文档接口
 @app.route('/api/upload-pdf', methods=['POST'])
@@ -60,71 +100,401 @@ def upload_pdf():
     file_ext = file.filename.rsplit('.', 1)[-1].lower()
     file_type = file_ext
     
-    if file_type not in ['pdf', 'txt']:
+    if file_type not in BOOK_TYPES:
         return jsonify({'success': False, 'error': '文件格式错误，仅支持PDF和TXT'})
         
-    # 构造文件名（保持不变）
-    safe_title = ''.join(c for c in title if c.isalnum() or c in (' ', '_', '-')).strip().replace(' ', '_')
-    if not safe_title:
-        safe_title = 'untitled'
-        
-    filename = f"{safe_title}_{int(time.time())}.{file_ext}"
-    file_path = os.path.join(app.config['PDF_FOLDER'], filename)
-    
+    # 文件按内容哈希存入 blob 存储，相同内容只保存一份
     try:
-        # 针对TXT文件进行编码处理
+        # 针对TXT文件进行编码处理：流式转码为UTF-8，只解码一遍
         if file_type == 'txt':
             # 获取前端传递的编码方式，默认UTF-8
             encoding = request.form.get('encoding', 'utf-8')
-            # 读取文件内容并转换为UTF-8编码保存
-            content = file.read()
-            
-            # 根据编码类型尝试不同的解码方式
-            text = ""
-            decode_success = False
-            
-            # 如果是中文编码类型，尝试常用的中文编码
-            if encoding in ['gbk', 'gb2312', 'gb18030']:
-                encodings_to_try = [encoding, 'gb18030', 'gbk', 'gb2312', 'utf-8']
-            else:
-                encodings_to_try = [encoding, 'utf-8', 'gbk', 'gb2312', 'gb18030']
-            
-            for enc in encodings_to_try:
-                try:
-                    text = content.decode(enc)
-                    decode_success = True
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if not decode_success:
-                # 如果所有编码都失败，使用utf-8并忽略错误
-                text = content.decode('utf-8', errors='ignore')
-            
-            # 以UTF-8编码写入文件
-            with codecs.open(file_path, 'w', encoding='utf-8') as f:
-                f.write(text)
+            file_key = storage.save_stream(file.stream, 'txt', txt_transcoder(encoding))
         else:
             # PDF文件直接保存
-            file.save(file_path)
+            file_key = storage.save_stream(file.stream, 'pdf')
     except Exception as e:
         app.logger.error(f'文件保存失败: {str(e)}')
         return jsonify({'success': False, 'error': f'文件保存失败: {str(e)}'})
     
-    relative_path = filename 
-    
-    new_book = PDFBook(title=title, file_path=relative_path, file_type=file_type)
+    new_book, job = create_book(title, file_type, file_key, request.files.get('cover'))
+    return jsonify({'success': True, 'book': new_book.to_dict(), 'job_id': job.id if job else None})
+
+
+BOOK_TYPES = ['pdf', 'txt']
+
+
+def txt_transcoder(encoding):
+    return lambda stream, out: txt_utils.transcode_to_utf8(stream, out, encoding)
+
+
+# 文件已存入 blob 存储后的建档（普通上传和分块上传共用）
+# 索引交给后台任务，返回 (书籍, 任务)；复用已有索引时任务为 None
+def create_book(title, file_type, file_key, cover=None):
+    new_book = PDFBook(title=title, file_path=file_key, file_type=file_type)
+
+    # 封面（可选）：生成固定尺寸的缩略图，失败不影响文档上传
+    if cover and cover.filename:
+        try:
+            new_book.cover_hash = images.save_cover_thumbnails(cover.stream, app.config['COVER_FOLDER'])
+        except Exception as e:
+            app.logger.warning(f'封面处理失败: {str(e)}')
+
     db.session.add(new_book)
+    db.session.flush()  # 先拿到 id，全文索引需要
+    storage.add_refs('book', new_book.id, [file_key])
+
+    # 同一内容之前上传过时直接复制已有的索引，不再扫描文件
+    source = PDFBook.query.filter(PDFBook.file_path == file_key, PDFBook.id != new_book.id,
+                                  PDFBook.file_size.isnot(None)).first()
+    job = None
+    if source:
+        copy_book_index(new_book, source)
+    else:
+        job = jobs.enqueue('index_book', {'book_id': new_book.id})
     db.session.commit()
-    
-    return jsonify({'success': True, 'book': new_book.to_dict()})
+    return new_book, job
+
+
+# 后台任务：为新上传的书籍建立索引
+@jobs.handler('index_book')
+def index_book_job(payload, report):
+    book = db.session.get(PDFBook, payload['book_id'])
+    if book is None:
+        return None  # 任务执行前书已被删除
+    if not os.path.exists(book_file_path(book)):
+        raise FileNotFoundError(book.file_path)
+
+    if book.file_type == 'txt':
+        report(0.1, '建立分页索引')
+        build_txt_page_index(book)
+        report(0.4, '提取章节目录')
+        build_txt_chapters(book)
+        report(0.6, '建立全文索引')
+        search.index_book(book.id, book_file_path(book), txt_utils.unpack_offsets(book.page_offsets))
+    else:
+        report(0.1, '扫描PDF结构')
+        index_pdf_book(book)
+    return {'book': book.to_dict()}
+
+
+# 书籍文件的实际路径（新上传的在 blob 存储里，旧数据在 PDF_FOLDER 下）
+def book_file_path(book):
+    return storage.resolve(book.file_path, app.config['PDF_FOLDER'])
+
+
+# 为 TXT 书籍建立分页索引（上传时调用，旧数据在首次阅读时补建）
+def build_txt_page_index(book):
+    file_path = book_file_path(book)
+    offsets, page_lines, line_count = txt_utils.build_page_index(file_path)
+    book.page_count = len(offsets) - 1
+    book.file_size = offsets[-1]
+    book.line_count = line_count
+    book.page_offsets = txt_utils.pack_index(offsets)
+    book.page_lines = txt_utils.pack_index(page_lines)
+
+
+# 为 TXT 书籍建立章节目录（需先建立分页索引，用于换算章节所在页）
+def build_txt_chapters(book):
+    file_path = book_file_path(book)
+    offsets = txt_utils.unpack_offsets(book.page_offsets)
+    file_size = offsets[-1]
+
+    # 重建时先删掉旧目录并 flush，避免与新插入的章节序号冲突
+    if book.chapters:
+        book.chapters = []
+        db.session.flush()
+
+    found = txt_utils.extract_chapters(file_path)
+    for i, (title, start) in enumerate(found):
+        end = found[i + 1][1] if i + 1 < len(found) else file_size
+        book.chapters.append(BookChapter(
+            chapter_no=i + 1,
+            title=title[:200],
+            start_offset=start,
+            end_offset=end,
+            page=bisect_right(offsets, start, 0, len(offsets) - 1)
+        ))
+
+
+# 书籍排队中或执行中的索引任务
+def active_index_job(book):
+    for job in Job.query.filter(Job.kind == 'index_book', Job.status.in_(('pending', 'running'))):
+        if json.loads(job.payload or '{}').get('book_id') == book.id:
+            return job
+    return None
+
+
+# 索引任务还没完成时返回 202，前端通过任务的 SSE 等它完成后重试
+def indexing_response(job):
+    return jsonify({'success': False, 'indexing': True, 'job_id': job.id,
+                    'error': '正在建立书籍索引，请稍后重试'}), 202
+
+
+# 没有索引的旧数据在首次阅读时补建（有索引任务时不调用，避免与任务同时重建）
+def index_txt_book(book):
+    build_txt_page_index(book)
+    build_txt_chapters(book)
+    file_path = book_file_path(book)
+    search.index_book(book.id, file_path, txt_utils.unpack_offsets(book.page_offsets))
+
+
+# 扫描 PDF 结构：页数、书签、文字层、线性化等（上传时调用）
+def index_pdf_book(book):
+    file_path = book_file_path(book)
+    info = pdf_utils.scan_pdf(file_path)
+    book.file_size = info['file_size']
+    book.page_count = info['page_count']
+    book.is_linearized = info['is_linearized']
+    book.has_text_layer = info['has_text_layer']
+    book.xref_offset = info['xref_offset']
+    book.outline = json.dumps(info['outline'], ensure_ascii=False) if info['outline'] else None
+
+
+# 复制同一文件已有的索引（分页、章节、PDF 结构和全文索引）
+def copy_book_index(book, source):
+    for column in ('file_size', 'page_count', 'line_count', 'page_offsets', 'page_lines',
+                   'is_linearized', 'has_text_layer', 'outline', 'xref_offset'):
+        setattr(book, column, getattr(source, column))
+    for chapter in source.chapters:
+        book.chapters.append(BookChapter(
+            chapter_no=chapter.chapter_no,
+            title=chapter.title,
+            start_offset=chapter.start_offset,
+            end_offset=chapter.end_offset,
+            page=chapter.page
+        ))
+    search.copy_book(source.id, book.id)
+
+
+# 补建索引命令：flask --app backend.app index-books [--force]
+@app.cli.command('index-books')
+@click.option('--force', is_flag=True, help='重建所有书籍的索引')
+def index_books_command(force):
+    txt_query = PDFBook.query.filter_by(file_type='txt')
+    pdf_query = PDFBook.query.filter_by(file_type='pdf')
+    if not force:
+        txt_query = txt_query.filter(PDFBook.page_offsets.is_(None))
+        pdf_query = pdf_query.filter(PDFBook.file_size.is_(None))
+
+    count = 0
+    for book in txt_query.all() + pdf_query.all():
+        file_path = book_file_path(book)
+        if not os.path.exists(file_path):
+            click.echo(f'跳过《{book.title}》：文件不存在')
+            continue
+        if book.file_type == 'txt':
+            index_txt_book(book)
+            click.echo(f'《{book.title}》：{book.page_count} 页，{len(book.chapters)} 章')
+        else:
+            index_pdf_book(book)
+            click.echo(f'《{book.title}》：{book.page_count} 页，{"已" if book.is_linearized else "未"}线性化')
+        db.session.commit()
+        count += 1
+    click.echo(f'完成，共处理 {count} 本书')
+
+
+# 为已有备忘录补建全文索引：flask --app backend.app index-notes
+@app.cli.command('index-notes')
+def index_notes_command():
+    count = 0
+    for note in Note.query.yield_per(200):
+        search.index_note(note.id, note.title, notes.plain_text(note.content))
+        count += 1
+    db.session.commit()
+    click.echo(f'完成，共索引 {count} 条备忘录')
+
+
+# 回收无人引用的上传文件：flask --app backend.app gc-uploads [--grace-hours N]
+@app.cli.command('gc-uploads')
+@click.option('--grace-hours', type=float, default=storage.GC_GRACE.total_seconds() / 3600,
+              help='无人引用超过这么多小时的文件才删除')
+def gc_uploads_command(grace_hours):
+    removed, freed = storage.collect_garbage(timedelta(hours=grace_hours))
+    click.echo(f'删除 {removed} 个文件，释放 {freed / 1024 / 1024:.1f} MB')
+
+
+# 后台任务：定期回收无人引用的上传文件
+@jobs.handler('gc_uploads')
+def gc_uploads_job(payload, report):
+    removed, freed = storage.collect_garbage()
+    return {'removed': removed, 'freed': freed}
+
+
+@jobs.handler('thin_note_revisions')
+def thin_note_revisions_job(payload, report):
+    return {'removed': revisions.thin_all()}
+
+
+# 把旧数据（按文件名存放在各目录下的文件）迁入 blob 存储并建立引用，之后才能被垃圾回收
+@app.cli.command('import-legacy-uploads')
+def import_legacy_uploads_command():
+    imported = {}  # 旧路径（相对 uploads）-> blob 键
+
+    def import_file(relative_path):
+        if relative_path not in imported:
+            path = safe_join(UPLOADS_BASE_DIR, relative_path)
+            if path is None or not os.path.isfile(path):
+                return None
+            imported[relative_path] = storage.add_file(path, storage.normalize_ext(path))
+        return imported[relative_path]
+
+    for book in PDFBook.query.all():
+        if not storage.is_blob_key(book.file_path):
+            key = import_file(f'pdfs/{book.file_path}')
+            if key:
+                book.file_path = key
+                storage.add_refs('book', book.id, [key])
+    for game in Game.query.all():
+        if not storage.is_blob_key(game.file_path):
+            key = import_file(f'games/{game.file_path}')
+            if key:
+                game.file_path = key
+                storage.add_refs('game', game.id, [key])
+
+    def replace_url(match):
+        key = import_file(unquote(match.group(1)))
+        return storage.blob_url(key) if key else match.group(0)
+
+    # 只替换图片地址，不记入历史版本：旧地址的文件已经移走，旧内容作为历史版本也无法显示；
+    # 替换不跨行，已有历史版本按行记录的反向差异仍然适用。版本号加一，打开着的编辑器
+    # 再保存时会收到冲突、重新加载，不会把基于旧内容的编辑应用到新内容上
+    for note in Note.query.all():
+        content = LEGACY_IMAGE_URL_PATTERN.sub(replace_url, note.content or '')
+        if content != note.content:
+            note.content = content
+            note.version += 1
+            storage.set_refs('note', note.id, storage.keys_in_text(content))
+
+    # uploads/notes/images 下没有被引用的旧图片作为孤儿导入，宽限期后回收
+    # （uploads/images 里还放着前端用的默认封面等静态图标，不做处理）
+    legacy_notes_dir = os.path.join(UPLOADS_BASE_DIR, 'notes', 'images')
+    if os.path.isdir(legacy_notes_dir):
+        for name in os.listdir(legacy_notes_dir):
+            import_file(f'notes/images/{name}')
+
+    db.session.commit()
+    click.echo(f'已导入 {len(imported)} 个文件')
+
+
+# 备忘录中引用旧上传图片的 URL
+LEGACY_IMAGE_URL_PATTERN = re.compile(r'/uploads/((?:notes/images|images)/[^)\s"\'<>]+)')
+
+
+# 分页读取 TXT 内容：/api/books/<id>/pages?from=N&count=M（页码从 1 开始）
+@app.route('/api/books/<int:book_id>/pages', methods=['GET'])
+def get_book_pages(book_id):
+    book = PDFBook.query.get_or_404(book_id)
+    if book.file_type != 'txt':
+        return jsonify({'success': False, 'error': '仅TXT文档支持分页读取'}), 400
+
+    start = request.args.get('from', 1, type=int)
+    count = request.args.get('count', 1, type=int)
+    if start < 1 or count < 1:
+        return jsonify({'success': False, 'error': '页码参数错误'}), 400
+    count = min(count, txt_utils.MAX_PAGES_PER_REQUEST)
+
+    file_path = book_file_path(book)
+    if not os.path.exists(file_path):
+        return jsonify({'success': False, 'error': '文件不存在'}), 404
+
+    if book.page_offsets is None:
+        job = active_index_job(book)
+        if job is not None:
+            return indexing_response(job)
+        index_txt_book(book)
+        db.session.commit()
+
+    offsets = txt_utils.unpack_offsets(book.page_offsets)
+    page_lines = txt_utils.unpack_lines(book.page_lines)
+    texts = txt_utils.read_pages(file_path, offsets, start - 1, count)
+
+    return jsonify({
+        'success': True,
+        'book_id': book.id,
+        'total_pages': book.page_count,
+        'from': start,
+        'pages': [{
+            'page': start + i,
+            'offset': offsets[start - 1 + i],
+            'line': page_lines[start - 1 + i],
+            'text': text
+        } for i, text in enumerate(texts)]
+    })
+
+
+# 书籍全文检索：/api/books/search?q=关键词[&book_id=N&limit=M]
+@app.route('/api/books/search', methods=['GET'])
+def search_books():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': '请输入检索词'}), 400
+    book_id = request.args.get('book_id', type=int)
+    limit = request.args.get('limit', 20, type=int)
+
+    hits = search.search_books(query, book_id=book_id, limit=limit)
+    titles = dict(db.session.query(PDFBook.id, PDFBook.title)
+                  .filter(PDFBook.id.in_({hit['book_id'] for hit in hits})).all()) if hits else {}
+    for hit in hits:
+        hit['title'] = titles.get(hit['book_id'], '')
+    return jsonify({'success': True, 'query': query, 'results': hits})
+
+# 获取 PDF 书签目录（上传时已提取，无需下载文件）
+@app.route('/api/books/<int:book_id>/outline', methods=['GET'])
+def get_book_outline(book_id):
+    book = PDFBook.query.get_or_404(book_id)
+    if book.file_type != 'pdf':
+        return jsonify({'success': False, 'error': '仅PDF文档支持书签目录'}), 400
+    return jsonify({
+        'success': True,
+        'book_id': book.id,
+        'page_count': book.page_count,
+        'outline': json.loads(book.outline) if book.outline else []
+    })
+
+# 获取 TXT 章节目录
+@app.route('/api/books/<int:book_id>/chapters', methods=['GET'])
+def get_book_chapters(book_id):
+    book = PDFBook.query.get_or_404(book_id)
+    if book.file_type != 'txt':
+        return jsonify({'success': False, 'error': '仅TXT文档支持章节目录'}), 400
+
+    if book.page_offsets is None:
+        job = active_index_job(book)
+        if job is not None:
+            return indexing_response(job)
+        if not os.path.exists(book_file_path(book)):
+            return jsonify({'success': False, 'error': '文件不存在'}), 404
+        index_txt_book(book)
+        db.session.commit()
+
+    chapters = BookChapter.query.filter_by(book_id=book_id).order_by(BookChapter.chapter_no).all()
+    return jsonify({
+        'success': True,
+        'book_id': book.id,
+        'chapters': [c.to_dict() for c in chapters]
+    })
+
+# 获取单个章节的正文
+@app.route('/api/books/<int:book_id>/chapters/<int:chapter_no>', methods=['GET'])
+def get_book_chapter(book_id, chapter_no):
+    chapter = BookChapter.query.filter_by(book_id=book_id, chapter_no=chapter_no).first_or_404()
+    file_path = book_file_path(chapter.book)
+    if not os.path.exists(file_path):
+        return jsonify({'success': False, 'error': '文件不存在'}), 404
+
+    result = chapter.to_dict()
+    result['text'] = txt_utils.read_range(file_path, chapter.start_offset, chapter.end_offset)
+    return jsonify({'success': True, 'book_id': book_id, 'chapter': result})
 
 
 # 获取文档文件接口
 @app.route('/uploads/pdfs/<path:filename>')
 def uploaded_pdf(filename):
     # Flask 自动处理 URL 解码，我们只需要提供正确的文件目录
-    return send_from_directory(app.config['PDF_FOLDER'], filename)
+    if storage.is_blob_key(filename):
+        return send_cached_file(os.path.dirname(storage.blob_path(filename)), filename)
+    return send_cached_file(app.config['PDF_FOLDER'], filename)
 
 # 获取所有文档列表
 @app.route('/api/get-pdfs', methods=['GET'])
@@ -136,14 +506,20 @@ def get_pdfs():
 @app.route('/api/delete-pdf/<int:book_id>', methods=['DELETE'])
 def delete_pdf(book_id):
     book = PDFBook.query.get_or_404(book_id)
-    file_path = os.path.join(app.config['PDF_FOLDER'], book.file_path) 
-    
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-        except Exception as e:
-            return jsonify({'success': False, 'error': f'文件删除失败：{str(e)}'})
+
+    # 文件可能被其他书共用：只删除引用，无人引用的文件由垃圾回收在宽限期后删除
+    storage.remove_refs('book', book.id)
+    try:
+        storage.remove_legacy_file(book.file_path, app.config['PDF_FOLDER'])
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'文件删除失败：{str(e)}'})
     
+    # 封面按内容去重，只有没有其他书使用时才删除缩略图
+    if book.cover_hash and not PDFBook.query.filter(
+            PDFBook.cover_hash == book.cover_hash, PDFBook.id != book.id).first():
+        images.delete_cover_thumbnails(book.cover_hash, app.config['COVER_FOLDER'])
+
+    search.remove_book(book.id)
     db.session.delete(book)
     db.session.commit()
     return jsonify({'success': True})
@@ -168,23 +544,36 @@ def upload_image():
         if file.filename == '' or not file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
             return jsonify({'success': False, 'error': '请上传图片文件（png, jpg, jpeg, gif）'}), 400
             
-        filename = f"{uuid.uuid4().hex}_{file.filename}"
-        file_path = os.path.join(app.config['IMAGE_FOLDER'], filename)
-        file.save(file_path)
+        saved = save_note_image(file)
+        db.session.commit()
         
         return jsonify({
             'success': True,
-            'image_url': f"/uploads/images/{filename}" 
+            'image_url': saved['url'],
+            'fallback_url': saved['fallback_url'],
+            'width': saved['width'],
+            'height': saved['height']
         })
         
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# 备忘录图片：摆正方向、去掉 EXIF、限制尺寸后存为 WebP 和兼容格式（均按内容哈希存储）
+def save_note_image(file):
+    data = file.stream.read(images.MAX_IMAGE_BYTES + 1)
+    if len(data) > images.MAX_IMAGE_BYTES:
+        raise ValueError('图片过大')
+    return notes.save_image(data, storage.normalize_ext(file.filename))
+
+
 # 提供上传图片的直接访问路由（备忘录图片等）
 @app.route('/uploads/images/<path:filename>')
 def uploaded_image(filename):
-    return send_from_directory(app.config['IMAGE_FOLDER'], filename)
+    return send_cached_file(app.config['IMAGE_FOLDER'], filename)
 
 
 # 主页路由
@@ -239,7 +628,29 @@ def delete_bookmark(bookmark_id):
 
 
 
+# 流式回复每隔这么多秒把已收到的内容写入消息，刷新页面后能看到
+QWEN_STREAM_SAVE_INTERVAL = 1.0
+
+
+QWEN_MODEL = "qwen-turbo"  # 可根据需要更换为其他Qwen模型
+
+
+def qwen_payload(messages):
+    return {
+        "model": QWEN_MODEL,
+        "messages": messages,
+        "temperature": 0.7
+    }
+
+
+qwen_cache = ResponseCache(app.config['QWEN_CACHE_MAX_ENTRIES'], app.config['QWEN_CACHE_TTL_SECONDS'],
+                           app.config['QWEN_CACHE_DB'])
+
+
 # Qwen API 调用接口（后端代理，避免前端跨域）
+# 相同的请求直接返回缓存的回复，同时发出的相同请求只调用一次上游
+# 带 conversation_id 时附带该对话的历史（超出预算的旧消息合并为滚动摘要）
+# 请求中 stream 为 true 时以 SSE 逐段转发回复，此时带 conversation_id 的回复边接收边保存为该对话的 AI 消息
 @app.route('/api/call-qwen', methods=['POST'])
 def call_qwen():
     try:
@@ -247,49 +658,115 @@ def call_qwen():
         if not data or not data.get('message') or not data.get('api_key'):
             return jsonify({'success': False, 'error': '缺少参数：message或api_key'}), 400
         
-        # 构建Qwen API请求参数
-        qwen_api_url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {data['api_key']}"
-        }
+        conv = None
+        if data.get('conversation_id') is not None:
+            conv = db.session.get(Conversation, data['conversation_id'])
+            if conv is None:
+                return jsonify({'success': False, 'error': '对话不存在'}), 404
         
-        payload = {
-            "model": "qwen-turbo",  # 可根据需要更换为其他Qwen模型
-            "messages": [
-                {"role": "user", "content": data['message']}
-            ],
-            "temperature": 0.7
-        }
+        # 构建Qwen API请求参数
+        if conv is not None:
+            messages = chat_context.build(conv, data['message'], data['api_key'], QWEN_MODEL)
+        else:
+            messages = [{"role": "user", "content": data['message']}]
+        payload = qwen_payload(messages)
         
-        # 调用Qwen API
-        response = requests.post(
-            qwen_api_url,
-            headers=headers,
-            data=json.dumps(payload)
-        )
+        if data.get('stream'):
+            return stream_qwen(data['api_key'], payload, conv)
         
-        # 处理API响应
-        if response.status_code == 200:
-            result = response.json()
-            if result.get('choices') and len(result['choices']) > 0:
-                return jsonify({
-                    'success': True,
-                    'response': result['choices'][0]['message']['content']
-                })
-            else:
-                return jsonify({'success': False, 'error': 'API返回格式异常'})
-        else:
-            return jsonify({
-                'success': False,
-                'error': f'API调用失败：{response.status_code}，{response.text}'
-            })
+        # 调用Qwen API（共用连接池，带超时、重试和熔断）
+        reply, cached = qwen_cache.get_or_call(make_key(data['api_key'], payload),
+                                               lambda: qwen_client.chat(data['api_key'], payload))
+        return jsonify({'success': True, 'response': reply, 'cached': cached})
             
+    except qwen_client.QwenAPIError as e:
+        return jsonify({'success': False, 'error': str(e)})
+    except qwen_client.CircuitOpenError as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    except requests.Timeout:
+        return jsonify({'success': False, 'error': 'API响应超时'}), 504
     except Exception as e:
         return jsonify({'success': False, 'error': f'服务器错误：{str(e)}'}), 500
+
+
+def stream_qwen(api_key, payload, conv=None, user_message=None):
+    """以 SSE 转发 Qwen 的流式回复
+
+    事件依次为若干 {"delta": 文本}，最后是 {"done": true, "message": 保存的消息}
+    或 {"error": 错误信息}；给出 user_message 时第一个事件是 {"user_message": 消息}。
+    上游连接失败时直接返回 JSON 错误。
+    缓存命中时整段回复作为一个 delta 返回；上游的回复完整接收后写入缓存。
+    """
+    key = make_key(api_key, payload)
+    cached = qwen_cache.get(key)
+    response = None
+    if cached is not None:
+        deltas = iter([cached])
+    else:
+        response = qwen_client.post_chat(api_key, dict(payload, stream=True), stream=True)
+        if response.status_code != 200:
+            error = f'API调用失败：{response.status_code}，{response.text}'
+            response.close()
+            return jsonify({'success': False, 'error': error})
+        deltas = qwen_client.stream_deltas(response)
+    
+    def event(data):
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        parts = []
+        message = None
+        last_saved = time.monotonic()
+        
+        def save():
+            # 首段内容到达时创建消息，之后原地更新
+            nonlocal message, last_saved
+            if conv is None or not parts:
+                return
+            if message is None:
+                message = Message(conversation_id=conv.id, role='ai', content='')
+                db.session.add(message)
+            message.content = ''.join(parts)
+            conv.updated_at = datetime.utcnow()
+            db.session.commit()
+            last_saved = time.monotonic()
+        
+        try:
+            if user_message is not None:
+                yield event({'user_message': user_message})
+            for delta in deltas:
+                parts.append(delta)
+                yield event({'delta': delta})
+                if time.monotonic() - last_saved >= QWEN_STREAM_SAVE_INTERVAL:
+                    save()
+            # 走到这里说明收到了 [DONE]（中途断开时 stream_deltas 抛出异常），只缓存完整的回复
+            if response is not None and parts:
+                qwen_cache.put(key, ''.join(parts))
+            save()
+            yield event({'done': True, 'message': message.to_dict() if message else None})
+        except Exception as e:
+            yield event({'error': f'回复中断：{str(e)}'})
+        finally:
+            # 出错或客户端断开时也保存已收到的部分
+            if response is not None:
+                response.close()
+            if message is None or message.content != ''.join(parts):
+                try:
+                    save()
+                except Exception:
+                    db.session.rollback()
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
     
    
 
+# AI 回复缓存的命中统计
+@app.route('/api/qwen-cache/stats', methods=['GET'])
+def qwen_cache_stats():
+    return jsonify({'success': True, 'stats': qwen_cache.stats()})
+
+
 # 获取所有对话列表
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
@@ -355,6 +832,66 @@ def add_message(conv_id):
         'conversation': conv.to_dict()
     })
 
+# 发送消息：保存用户消息、调用模型、保存回复，一次请求完成
+# 请求中 stream 为 true 时以 SSE 返回（同 /api/call-qwen），不带 api_key 时使用已保存的AI配置
+@app.route('/api/conversations/<int:conv_id>/send', methods=['POST'])
+def send_message(conv_id):
+    data = request.json
+    if not data or not data.get('content'):
+        return jsonify({'success': False, 'error': '消息内容不能为空'}), 400
+    conv = Conversation.query.get_or_404(conv_id)
+    api_key = data.get('api_key')
+    if not api_key:
+        config = AIConfig.query.first()
+        api_key = config.api_key if config else None
+    if not api_key:
+        return jsonify({'success': False, 'error': '缺少参数：api_key'}), 400
+    
+    # 第一步：保存用户消息（第一条消息同时用作对话标题）
+    # 客户端重试时最后一条是内容相同、还没有回复的用户消息，沿用它，不重复保存
+    last = Message.query.filter_by(conversation_id=conv_id).order_by(Message.id.desc()).first()
+    if last is not None and last.role == 'user' and last.content == data['content']:
+        user_msg = last
+    else:
+        user_msg = Message(conversation_id=conv_id, role='user', content=data['content'])
+        db.session.add(user_msg)
+        if last is None:
+            conv.title = data['content'][:30]
+    conv.updated_at = datetime.utcnow()
+    db.session.commit()
+    
+    try:
+        payload = qwen_payload(chat_context.build(conv, api_key=api_key, model=QWEN_MODEL))
+        if data.get('stream'):
+            # 回复边接收边保存（见 stream_qwen）
+            return stream_qwen(api_key, payload, conv, user_message=user_msg.to_dict())
+        
+        # 第二步：调用模型，第三步：保存回复
+        reply, cached = qwen_cache.get_or_call(make_key(api_key, payload),
+                                               lambda: qwen_client.chat(api_key, payload))
+        ai_msg = Message(conversation_id=conv_id, role='ai', content=reply)
+        db.session.add(ai_msg)
+        conv.updated_at = datetime.utcnow()
+        db.session.commit()
+        return jsonify({
+            'success': True,
+            'user_message': user_msg.to_dict(),
+            'message': ai_msg.to_dict(),
+            'title': conv.title,
+            'cached': cached
+        })
+    
+    # 调用失败时用户消息已保存，一并返回
+    except qwen_client.QwenAPIError as e:
+        return jsonify({'success': False, 'error': str(e), 'user_message': user_msg.to_dict()})
+    except qwen_client.CircuitOpenError as e:
+        return jsonify({'success': False, 'error': str(e), 'user_message': user_msg.to_dict()}), 503
+    except requests.Timeout:
+        return jsonify({'success': False, 'error': 'API响应超时', 'user_message': user_msg.to_dict()}), 504
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'服务器错误：{str(e)}', 'user_message': user_msg.to_dict()}), 500
+
 # 删除对话
 @app.route('/api/conversations/<int:conv_id>', methods=['DELETE'])
 def delete_conversation(conv_id):
@@ -371,14 +908,18 @@ def create_note():
     if not data or not data.get('title'):
         return jsonify({'success': False, 'error': '标题不能为空'}), 400
     
+    content, _ = notes.extract_inline_images(data.get('content', ''))
     new_note = Note(
         id=str(uuid.uuid4()),  # 使用UUID作为唯一标识
         title=data['title'],
-        content=data.get('content', ''),
+        content=content,
         created_at=datetime.utcnow(),
         updated_at=datetime.utcnow()
     )
+    new_note.snippet = notes.make_snippet(new_note.content)
     db.session.add(new_note)
+    storage.set_refs('note', new_note.id, storage.keys_in_text(new_note.content))
+    search.index_note(new_note.id, new_note.title, notes.plain_text(new_note.content))
     db.session.commit()
     
     return jsonify({
@@ -387,25 +928,195 @@ def create_note():
     })
 
 # 获取所有备忘录
+# ?view=summary 只返回标题和摘要（不含正文），按 limit/cursor 游标分页
 @app.route('/api/notes', methods=['GET'])
 def get_notes():
-    notes = Note.query.order_by(Note.updated_at.desc()).all()
+    note_buffer.flush()
+    if request.args.get('view') != 'summary':
+        all_notes = Note.query.order_by(Note.updated_at.desc()).all()
+        return jsonify({
+            'success': True,
+            'notes': [note.to_dict() for note in all_notes]
+        })
+
+    limit = request.args.get('limit', notes.DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, notes.MAX_PAGE_SIZE))
+    query = Note.query.options(load_only(Note.id, Note.title, Note.snippet, Note.updated_at)) \
+        .order_by(Note.updated_at.desc(), Note.id.desc())
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            updated_at, note_id = notes.decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        query = query.filter(tuple_(Note.updated_at, Note.id) < (updated_at, note_id))
+
+    page = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = notes.encode_cursor(page[-1].updated_at, page[-1].id)
     return jsonify({
         'success': True,
-        'notes': [note.to_dict() for note in notes]
+        'notes': [note.to_summary_dict() for note in page],
+        'next_cursor': next_cursor
     })
 
-# 更新备忘录
+# 备忘录全文检索：/api/notes/search?q=关键词[&limit=M]，标题和摘要中的命中词用 <mark> 标出
+@app.route('/api/notes/search', methods=['GET'])
+def search_notes():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': '请输入检索词'}), 400
+    limit = request.args.get('limit', 20, type=int)
+
+    note_buffer.flush()
+    hits = search.search_notes(query, limit=limit)
+    edited = dict(db.session.query(Note.id, Note.updated_at)
+                  .filter(Note.id.in_({hit['id'] for hit in hits})).all()) if hits else {}
+    for hit in hits:
+        updated_at = edited.get(hit['id'])
+        hit['last_edited'] = updated_at.strftime('%Y-%m-%d %H:%M') if updated_at else ''
+    return jsonify({'success': True, 'query': query, 'results': hits})
+
+# 获取单条备忘录（含正文）
+@app.route('/api/notes/<string:note_id>', methods=['GET'])
+def get_note(note_id):
+    note_buffer.flush(note_id)
+    note = Note.query.get_or_404(note_id)
+    return jsonify({'success': True, 'note': note.to_dict()})
+
+def extract_note_images(content):
+    """保存前把内嵌的 base64 图片存入 blob 存储；新图片先提交，之后的保存失败也不会丢失记录"""
+    content, extracted = notes.extract_inline_images(content)
+    if extracted:
+        db.session.commit()
+    return content, extracted
+
+
+def extract_patch_images(ops):
+    """增量保存时提取编辑操作插入的内嵌图片（格式不对的操作留给 apply_patch 报错）"""
+    if not isinstance(ops, list):
+        return ops, 0
+    total = 0
+    rewritten = []
+    for op in ops:
+        if isinstance(op, dict) and isinstance(op.get('insert'), str):
+            insert, extracted = notes.extract_inline_images(op['insert'])
+            if extracted:
+                op = dict(op, insert=insert)
+                total += extracted
+        rewritten.append(op)
+    if total:
+        db.session.commit()
+    return rewritten, total
+
+
+def note_conflict(note, version=None):
+    db.session.rollback()
+    return jsonify({
+        'success': False,
+        'error': '备忘录已在其他地方修改，请重新加载',
+        'version': note.version if version is None else version
+    }), 409
+
+# 更新备忘录（提交完整内容；带 version 时检查冲突）
 @app.route('/api/notes/<string:note_id>', methods=['PUT'])
 def update_note(note_id):
     note = Note.query.get_or_404(note_id)
     data = request.json
+    content = data.get('content')
+    if content is not None:
+        content, _ = extract_note_images(content)
     
-    if 'title' in data:
-        note.title = data['title']
-    if 'content' in data:
-        note.content = data['content']
-    note.updated_at = datetime.utcnow()
+    if note_buffer.enabled():
+        saved, state = note_buffer.save(note, data.get('version'), data.get('title'), content)
+        if not saved:
+            return note_conflict(note, state['version'])
+        return jsonify({'success': True, 'note': note_buffer.as_note(note, state).to_dict()})
+    
+    if not notes.write(note, data.get('title'), content, data.get('version')):
+        return note_conflict(note)
+    
+    db.session.commit()
+    return jsonify({'success': True, 'note': note.to_dict()})
+
+# 增量保存备忘录：提交基于 version 的编辑操作，响应中不含正文
+@app.route('/api/notes/<string:note_id>', methods=['PATCH'])
+def patch_note(note_id):
+    note = Note.query.get_or_404(note_id)
+    data = request.json or {}
+    version = data.get('version')
+    if not isinstance(version, int):
+        return jsonify({'success': False, 'error': '缺少版本号'}), 400
+    # 内嵌图片被改写成地址时，客户端的内容和服务端不再一致，响应中附上完整内容
+    ops, extracted = extract_patch_images(data.get('ops'))
+    
+    if note_buffer.enabled():
+        try:
+            saved, state = note_buffer.save(note, version, data.get('title'), ops=ops)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if not saved:
+            return note_conflict(note, state['version'])
+        saved_note = note_buffer.as_note(note, state)
+    else:
+        if version != note.version:
+            return note_conflict(note)
+        
+        content = None
+        if ops is not None:
+            try:
+                content = notes.apply_patch(note.content, ops)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+        
+        if not notes.write(note, data.get('title'), content, version):
+            return note_conflict(note)
+        
+        db.session.commit()
+        saved_note = note
+    
+    result = saved_note.to_summary_dict()
+    if extracted:
+        result['content'] = saved_note.content
+    return jsonify({'success': True, 'note': result})
+
+# 备忘录的历史版本列表（从新到旧）
+@app.route('/api/notes/<string:note_id>/revisions', methods=['GET'])
+def get_note_revisions(note_id):
+    note_buffer.flush(note_id)
+    note = Note.query.get_or_404(note_id)
+    history = NoteRevision.query.filter_by(note_id=note.id) \
+        .options(load_only(NoteRevision.id, NoteRevision.note_id, NoteRevision.version, NoteRevision.title,
+                           NoteRevision.content_length, NoteRevision.created_at)) \
+        .order_by(NoteRevision.version.desc()).all()
+    return jsonify({
+        'success': True,
+        'revisions': [revision.to_dict() for revision in history]
+    })
+
+# 获取某个历史版本的内容
+@app.route('/api/notes/<string:note_id>/revisions/<int:revision_id>', methods=['GET'])
+def get_note_revision(note_id, revision_id):
+    note_buffer.flush(note_id)
+    note = Note.query.get_or_404(note_id)
+    revision = NoteRevision.query.filter_by(id=revision_id, note_id=note.id).first_or_404()
+    data = revision.to_dict()
+    data['content'] = revisions.content_of(revision, note.content or '')
+    return jsonify({'success': True, 'revision': data})
+
+# 恢复到某个历史版本（作为一次新的保存，当前内容也会记入历史）
+@app.route('/api/notes/<string:note_id>/revisions/<int:revision_id>/restore', methods=['POST'])
+def restore_note_revision(note_id, revision_id):
+    note_buffer.flush(note_id)
+    note = Note.query.get_or_404(note_id)
+    revision = NoteRevision.query.filter_by(id=revision_id, note_id=note.id).first_or_404()
+    content = revisions.content_of(revision, note.content or '')
+    # 还原出的内容基于读取时的当前内容，之后被其他保存修改过就返回冲突
+    data = request.get_json(silent=True) or {}
+    if not notes.write(note, revision.title, content, data.get('version', note.version)):
+        return note_conflict(note)
     
     db.session.commit()
     return jsonify({'success': True, 'note': note.to_dict()})
@@ -414,6 +1125,10 @@ def update_note(note_id):
 @app.route('/api/notes/<string:note_id>', methods=['DELETE'])
 def delete_note(note_id):
     note = Note.query.get_or_404(note_id)
+    note_buffer.discard(note.id)
+    storage.remove_refs('note', note.id)
+    revisions.remove(note.id)
+    search.remove_note(note.id)
     db.session.delete(note)
     db.session.commit()
     return jsonify({'success': True})
@@ -484,32 +1199,31 @@ def upload_game():
         return jsonify({'success': False, 'error': '未选择文件'})
     
     # 验证文件类型（仅HTML/JS/CSS等）
-    allowed_extensions = ['.html', '.htm', '.js', '.css', '.zip']
     file_ext = os.path.splitext(file.filename)[1].lower()
-    if file_ext not in allowed_extensions:
+    if file_ext not in GAME_EXTENSIONS:
         return jsonify({'success': False, 'error': '文件格式错误，仅支持HTML、JS、CSS或ZIP文件'})
         
-    # 构造文件名
-    safe_name = ''.join(c for c in name if c.isalnum() or c in (' ', '_', '-')).strip().replace(' ', '_')
-    if not safe_name:
-        safe_name = 'untitled'
-        
-    filename = f"{safe_name}_{int(time.time())}{file_ext}"
-    file_path = os.path.join(app.config['GAME_FOLDER'], filename)
-    
+    # 按内容哈希存入 blob 存储
     try:
-        file.save(file_path)
+        file_key = storage.save_stream(file.stream, file_ext.lstrip('.'))
     except Exception as e:
         app.logger.error(f'游戏文件保存失败: {str(e)}')
         return jsonify({'success': False, 'error': f'文件保存失败: {str(e)}'})
     
-    relative_path = filename 
-    
-    new_game = Game(name=name, file_path=relative_path, game_type='custom')
+    new_game = create_game(name, file_key)
+    return jsonify({'success': True, 'game': new_game.to_dict()})
+
+
+GAME_EXTENSIONS = ['.html', '.htm', '.js', '.css', '.zip']
+
+
+def create_game(name, file_key):
+    new_game = Game(name=name, file_path=file_key, game_type='custom')
     db.session.add(new_game)
+    db.session.flush()
+    storage.add_refs('game', new_game.id, [file_key])
     db.session.commit()
-    
-    return jsonify({'success': True, 'game': new_game.to_dict()})
+    return new_game
 
 # 获取所有游戏列表
 @app.route('/api/get-games', methods=['GET'])
@@ -521,18 +1235,142 @@ def get_games():
 @app.route('/api/delete-game/<int:game_id>', methods=['DELETE'])
 def delete_game(game_id):
     game = Game.query.get_or_404(game_id)
-    file_path = os.path.join(app.config['GAME_FOLDER'], game.file_path) 
-    
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-        except Exception as e:
-            return jsonify({'success': False, 'error': f'文件删除失败：{str(e)}'})
+
+    storage.remove_refs('game', game.id)
+    try:
+        storage.remove_legacy_file(game.file_path, app.config['GAME_FOLDER'])
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'文件删除失败：{str(e)}'})
     
     db.session.delete(game)
     db.session.commit()
     return jsonify({'success': True})
 
+# 创建分块上传会话：{kind: book|game, filename, size, sha256?, title/name, encoding}
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    data = request.json or {}
+    kind = data.get('kind')
+    filename = os.path.basename(data.get('filename') or '')
+    size = data.get('size')
+    sha256 = (data.get('sha256') or '').lower() or None
+
+    if kind == 'book':
+        file_ext = filename.rsplit('.', 1)[-1].lower()
+        if file_ext not in BOOK_TYPES:
+            return jsonify({'success': False, 'error': '文件格式错误，仅支持PDF和TXT'}), 400
+        params = {'title': data.get('title') or '未命名文档', 'encoding': data.get('encoding') or 'utf-8'}
+    elif kind == 'game':
+        file_ext = os.path.splitext(filename)[1].lower()
+        if file_ext not in GAME_EXTENSIONS:
+            return jsonify({'success': False, 'error': '文件格式错误，仅支持HTML、JS、CSS或ZIP文件'}), 400
+        file_ext = file_ext.lstrip('.')
+        params = {'name': data.get('name') or '未命名游戏'}
+    else:
+        return jsonify({'success': False, 'error': '上传类型错误'}), 400
+
+    if not isinstance(size, int) or not 0 < size <= uploads.MAX_UPLOAD_BYTES:
+        return jsonify({'success': False, 'error': '文件大小无效'}), 400
+    if sha256 and not storage.BLOB_KEY_PATTERN.match(f'{sha256}.{file_ext}'):
+        return jsonify({'success': False, 'error': '文件哈希格式错误'}), 400
+
+    uploads.expire_sessions()
+    upload = uploads.create_session(kind, filename, file_ext, size, sha256, params)
+    db.session.commit()
+    return jsonify({'success': True, 'upload': upload.to_dict()})
+
+# 查询上传进度（断线后据此从 offset 处继续）
+@app.route('/api/uploads/<string:upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id)
+    return jsonify({'success': True, 'upload': upload.to_dict()})
+
+# 上传一个分块：请求体为原始数据，X-Chunk-Sha256 头为该块的 SHA-256
+@app.route('/api/uploads/<string:upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_upload_chunk(upload_id, index):
+    upload = UploadSession.query.get_or_404(upload_id)
+    checksum = request.headers.get('X-Chunk-Sha256')
+    if not checksum:
+        return jsonify({'success': False, 'error': '缺少分块校验值'}), 400
+
+    start = index * upload.chunk_size
+    if start < upload.received_bytes:
+        # 重传已经收到的块（例如响应丢失），直接返回当前进度
+        return jsonify({'success': True, 'upload': upload.to_dict()})
+    if start > upload.received_bytes or start >= upload.total_size:
+        return jsonify({'success': False, 'error': '分块序号错误', 'upload': upload.to_dict()}), 409
+
+    length = min(upload.chunk_size, upload.total_size - start)
+    try:
+        uploads.append_chunk(upload, request.stream, length, checksum)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e), 'upload': upload.to_dict()}), 400
+    db.session.commit()
+    return jsonify({'success': True, 'upload': upload.to_dict()})
+
+# 完成分块上传，执行与普通上传相同的后续处理（书籍可附带 cover 封面文件）
+@app.route('/api/uploads/<string:upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id)
+    if upload.received_bytes < upload.total_size:
+        return jsonify({'success': False, 'error': '文件尚未传完', 'upload': upload.to_dict()}), 409
+
+    params = json.loads(upload.params or '{}')
+    transform = None
+    if upload.kind == 'book' and upload.file_ext == 'txt':
+        transform = txt_transcoder(params.get('encoding', 'utf-8'))
+    try:
+        file_key = uploads.finish(upload, transform)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f'文件保存失败: {str(e)}')
+        return jsonify({'success': False, 'error': f'文件保存失败: {str(e)}'}), 400
+    db.session.delete(upload)
+
+    if upload.kind == 'book':
+        new_book, job = create_book(params.get('title', '未命名文档'), upload.file_ext, file_key,
+                                    request.files.get('cover'))
+        return jsonify({'success': True, 'book': new_book.to_dict(), 'job_id': job.id if job else None})
+    new_game = create_game(params.get('name', '未命名游戏'), file_key)
+    return jsonify({'success': True, 'game': new_game.to_dict()})
+
+# 放弃分块上传
+@app.route('/api/uploads/<string:upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id)
+    uploads.discard(upload)
+    db.session.commit()
+    return jsonify({'success': True})
+
+# 查询后台任务状态
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    return jsonify({'success': True, 'job': jobs.status(job)})
+
+# 以 SSE 推送后台任务进度，任务结束后关闭连接
+@app.route('/api/jobs/<int:job_id>/events', methods=['GET'])
+def job_events(job_id):
+    Job.query.get_or_404(job_id)
+
+    def generate():
+        last = None
+        while True:
+            db.session.expire_all()
+            data = jobs.status(db.session.get(Job, job_id))
+            if data != last:
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+                last = data
+            if data['status'] in ('done', 'failed'):
+                break
+            time.sleep(JOB_EVENT_INTERVAL)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+JOB_EVENT_INTERVAL = 0.5
+
 # 获取/保存AI配置
 @app.route('/api/ai-config', methods=['GET', 'POST'])
 def ai_config():
@@ -577,32 +1415,42 @@ def upload_image_route():
         if file.filename == '':
             return jsonify({"success": False, "error": "No selected file"}), 400
         
-        filename = file.filename 
-        
-        # 2. 定义您想保存的具体子目录
-        # (这应该与您前端请求的路径 /uploads/notes/images/ 一致)
-        target_directory = os.path.join(UPLOADS_BASE_DIR, 'notes', 'images')
-        
-        # 3. ✅ 关键修复：在保存前，确保这个目录存在
-        os.makedirs(target_directory, exist_ok=True)
-        
-        # 4. 定义完整的文件保存路径
-        save_path = os.path.join(target_directory, filename)
-        
-        # 5. 保存文件
-        file.save(save_path)
-        
-        # 6. 构造给前端的 URL
-        file_url = f"/uploads/notes/images/{filename}" 
+        # 压缩后按内容哈希存入 blob 存储，同一张图片只保存一份，文件名不会冲突
+        # （旧图片仍在 /uploads/notes/images/ 下，由 serve_uploaded_file 提供）
+        saved = save_note_image(file)
+        db.session.commit()
         
-        # 7. 只有在真正保存成功后，才返回成功
-        return jsonify({"success": True, "url": file_url})
+        # 只有在真正保存成功后，才返回成功
+        return jsonify({"success": True, **saved})
 
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
-        # 8. ✅ 关键修复：如果发生任何错误，必须返回失败的 JSON
+        # 如果发生任何错误，必须返回失败的 JSON
+        db.session.rollback()
         print(f"Error saving image: {e}") # 在服务器上打印错误
         return jsonify({"success": False, "error": f"Internal server error: {e}"}), 500
     
+# 按需缩放的图片：/img/<宽>x<高>/<uploads 下的路径>，宽或高为 0 表示按比例计算
+resized_images = ImageCache(app.config['IMAGE_CACHE_FOLDER'], app.config['IMAGE_CACHE_MAX_BYTES'])
+
+@app.route('/img/<int:width>x<int:height>/<path:subpath>')
+def resized_image(width, height, subpath):
+    if not (width or height) or width > MAX_DIMENSION or height > MAX_DIMENSION:
+        return jsonify({'success': False, 'error': '图片尺寸无效'}), 400
+    source_path = safe_join(UPLOADS_BASE_DIR, subpath)
+    if source_path is None or subpath.startswith('cache/') or not os.path.isfile(source_path):
+        abort(404)
+
+    try:
+        cached = resized_images.get(source_path, width, height)
+    except (UnidentifiedImageError, OSError):
+        return jsonify({'success': False, 'error': '无法识别的图片'}), 415
+    # 不需要缩小或旋转（目标不小于原图，或是动图）时直接返回原图
+    if cached is None:
+        return send_cached_file(UPLOADS_BASE_DIR, subpath)
+    return send_cached_file(app.config['IMAGE_CACHE_FOLDER'], cached)
+
 @app.route('/uploads/<path:subpath>')
 def serve_uploaded_file(subpath):
     """
@@ -610,7 +1458,7 @@ def serve_uploaded_file(subpath):
     'subpath' 会自动捕获 URL 中 'uploads/' 之后的所有内容，
     例如 'notes/images/9ae4b168909be01f27d7ae41ec5be621.jpeg'
     """
-    return send_from_directory(UPLOADS_BASE_DIR, subpath)
+    return send_cached_file(UPLOADS_BASE_DIR, subpath)
 
 if __name__ == '__main__':
     with app.app_context():
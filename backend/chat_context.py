@@ -0,0 +1,162 @@
+"""为 AI 对话组装多轮上下文
+
+只按 (conversation_id, id) 索引倒序读取还没进入摘要的最近消息，按估算的 token 数装进预算
+（CHAT_CONTEXT_TOKENS）。未摘要的历史超出预算时，把最早的若干轮交给模型合并进对话的
+滚动摘要（保存在 Conversation.summary），之后只保留约一半预算的最近消息；摘要作为系统
+消息放在最前面。摘要失败时只是丢弃放不下的旧消息，下次再试。
+
+折叠总是从最早的未摘要消息开始，按时间顺序分批读取（包括最近 MAX_HISTORY_MESSAGES 条
+之前没读到的消息）。积压很多时每次请求最多调用 MAX_SUMMARY_CALLS 次模型，分几轮追上。
+
+token 数用字符估算（汉字等约 1 个、其他约 4 个字符 1 个），不调用分词器。
+"""
+import re
+
+from flask import current_app
+from sqlalchemy import update
+
+from . import qwen_client
+from .models import db, Conversation, Message
+
+DEFAULT_BUDGET_TOKENS = 3000
+# 每次最多读取的未摘要消息数
+MAX_HISTORY_MESSAGES = 200
+# 摘要后最近消息最多占预算的比例，留出余量，不必每轮都重新摘要
+RECENT_SHARE = 0.5
+SUMMARY_MAX_TOKENS = 400
+# 每次交给模型摘要的旧消息最多这么多 token，更多的分批摘要
+SUMMARY_INPUT_TOKENS = 6000
+# 每次请求最多调用几次模型更新摘要
+MAX_SUMMARY_CALLS = 3
+# 每条消息的角色、分隔等固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_WIDE_CHARS = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+SUMMARY_PROMPT = '你负责压缩对话历史。把已有摘要和新增的对话合并为一段摘要，保留关键事实、' \
+                 '用户的要求和偏好、尚未解决的问题，不要编造内容，不超过{limit}字，只输出摘要本身。'
+
+
+def estimate_tokens(text):
+    text = text or ''
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def _turn(message):
+    return {'role': 'assistant' if message.role == 'ai' else 'user', 'content': message.content}
+
+
+def _cost(turn):
+    return estimate_tokens(turn['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+def build(conv, message=None, api_key=None, model='qwen-turbo', budget=None):
+    """返回发给模型的 messages 列表
+
+    message 是本轮用户消息；已经保存为对话的最后一条消息时不会重复加入。
+    提供 api_key 时，历史超出预算会先更新滚动摘要（单独提交）。
+    """
+    budget = budget or current_app.config.get('CHAT_CONTEXT_TOKENS', DEFAULT_BUDGET_TOKENS)
+    rows = Message.query.filter(Message.conversation_id == conv.id,
+                                Message.id > (conv.summary_message_id or 0)) \
+        .order_by(Message.id.desc()).limit(MAX_HISTORY_MESSAGES).all()
+    rows.reverse()
+    history = [(row.id, _turn(row)) for row in rows]
+    if message is not None and not (rows and rows[-1].role == 'user' and rows[-1].content == message):
+        history.append((None, {'role': 'user', 'content': message}))
+
+    summary = conv.summary
+    total = sum(_cost(turn) for _, turn in history) + estimate_tokens(summary)
+    if total > budget and api_key and len(history) > 1:
+        # 从最早的消息开始折叠，直到剩下的最近消息不超过预算的 RECENT_SHARE
+        remaining = sum(_cost(turn) for _, turn in history)
+        split = 0
+        while split < len(history) - 1 and remaining > budget * RECENT_SHARE:
+            remaining -= _cost(history[split][1])
+            split += 1
+        folded = [(message_id, turn) for message_id, turn in history[:split] if message_id is not None]
+        if folded:
+            try:
+                _fold(conv, folded[-1][0], api_key, model)
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.warning(f'对话 {conv.id} 更新摘要失败: {e}')
+            summary = conv.summary
+            covered = conv.summary_message_id or 0
+            history = [(message_id, turn) for message_id, turn in history
+                       if message_id is None or message_id > covered]
+
+    # 从最新往前装，装不下的旧消息不发送
+    used = estimate_tokens(summary) + MESSAGE_OVERHEAD_TOKENS if summary else 0
+    recent = []
+    for _, turn in reversed(history):
+        cost = _cost(turn)
+        if recent and used + cost > budget:
+            break
+        recent.append(turn)
+        used += cost
+    recent.reverse()
+
+    if summary:
+        recent.insert(0, {'role': 'system', 'content': f'以下是本次对话较早内容的摘要：\n{summary}'})
+    return recent
+
+
+def _line(turn):
+    return f"{'用户' if turn['role'] == 'user' else 'AI'}：{turn['content']}"
+
+
+def _fold(conv, last_id, api_key, model):
+    """从最早的未摘要消息开始，按时间顺序分批合并进摘要，直到 last_id（含）
+
+    每批最多 SUMMARY_INPUT_TOKENS，最多 MAX_SUMMARY_CALLS 批，没有追上的留给之后的请求。
+    """
+    for _ in range(MAX_SUMMARY_CALLS):
+        start = conv.summary_message_id or 0
+        if start >= last_id:
+            return
+        rows = Message.query.filter(Message.conversation_id == conv.id,
+                                    Message.id > start, Message.id <= last_id) \
+            .order_by(Message.id).limit(MAX_HISTORY_MESSAGES).all()
+        if not rows:
+            return
+        batch = []
+        used = 0
+        for row in rows:
+            turn = _turn(row)
+            used += estimate_tokens(_line(turn))
+            if batch and used > SUMMARY_INPUT_TOKENS:
+                break
+            batch.append((row.id, turn))
+        _update_summary(conv, batch, api_key, model)
+
+
+def _update_summary(conv, folded, api_key, model):
+    """把 folded 中的消息合并进滚动摘要并提交，完成后 conv 是数据库中的最新状态
+
+    用条件更新写入：并发请求已经先一步更新过摘要时不覆盖，沿用数据库中的摘要。
+    """
+    lines = [_line(turn) for _, turn in folded]
+    prompt = (f'已有摘要：\n{conv.summary}\n\n' if conv.summary else '') + '新增对话：\n' + '\n'.join(lines)
+
+    summary = qwen_client.chat(api_key, {
+        'model': model,
+        'messages': [
+            {'role': 'system', 'content': SUMMARY_PROMPT.format(limit=SUMMARY_MAX_TOKENS)},
+            {'role': 'user', 'content': prompt},
+        ],
+        'temperature': 0.3,
+        'max_tokens': SUMMARY_MAX_TOKENS,
+    }).strip()
+
+    # updated_at 保持不变，更新摘要不影响对话列表的排序
+    db.session.execute(
+        update(Conversation)
+        .where(Conversation.id == conv.id,
+               Conversation.summary_message_id.is_not_distinct_from(conv.summary_message_id))
+        .values(summary=summary, summary_message_id=folded[-1][0], updated_at=Conversation.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    db.session.refresh(conv)
@@ -0,0 +1,159 @@
+"""上传文件的 HTTP 缓存与范围请求
+
+上传文件的文件名都带时间戳或 UUID，内容写入后不再改变，因此可以使用强 ETag
+和一年的 immutable 缓存。单段 Range 交给 Werkzeug 处理，多段 Range 在这里
+以 multipart/byteranges 流式返回，pdf.js 等客户端可以按需分段加载。
+"""
+import mimetypes
+import os
+import uuid
+
+from flask import Response, abort, request, send_from_directory
+from werkzeug.security import safe_join
+
+# 一年，按 RFC 9111 的惯例作为“永不过期”
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+READ_CHUNK = 64 * 1024
+# 超过这个段数的 Range 请求直接返回整个文件，防止被用来放大请求
+MAX_RANGES = 32
+
+
+def file_etag(stat):
+    """由文件大小和修改时间生成强 ETag（文件名唯一，内容不会原地改变）"""
+    return f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+
+def _parse_ranges(header, length):
+    """解析 Range 头，返回合并后的 [(start, end)]（end 不含）；格式错误返回 None"""
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        first, sep, last = part.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if first == '':
+                suffix = int(last)
+                start, end = max(0, length - suffix), length
+            else:
+                start = int(first)
+                end = int(last) + 1 if last else length
+        except ValueError:
+            return None
+        if start < 0 or end <= start and start < length:
+            return None
+        end = min(end, length)
+        if start < end:
+            ranges.append((start, end))
+
+    # 合并重叠或相邻的区间
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _apply_cache_headers(response, etag):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    response.accept_ranges = 'bytes'
+    return response
+
+
+def _multipart_ranges_response(path, stat, ranges):
+    length = stat.st_size
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    boundary = uuid.uuid4().hex
+
+    part_headers = [
+        (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+         f'Content-Range: bytes {start}-{end - 1}/{length}\r\n\r\n').encode('ascii')
+        for start, end in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode('ascii')
+    total = sum(len(h) for h in part_headers) + sum(end - start for start, end in ranges) \
+        + 2 * (len(ranges) - 1) + len(closing)
+
+    def generate():
+        with open(path, 'rb') as f:
+            for i, ((start, end), header) in enumerate(zip(ranges, part_headers)):
+                if i:
+                    yield b'\r\n'
+                yield header
+                f.seek(start)
+                remaining = end - start
+                while remaining:
+                    data = f.read(min(READ_CHUNK, remaining))
+                    if not data:
+                        return
+                    remaining -= len(data)
+                    yield data
+        yield closing
+
+    response = Response(generate(), status=206,
+                        content_type=f'multipart/byteranges; boundary={boundary}')
+    response.content_length = total
+    response.last_modified = stat.st_mtime
+    return response
+
+
+def _single_range_response(path, stat, start, end):
+    def generate():
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining:
+                data = f.read(min(READ_CHUNK, remaining))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+
+    response = Response(generate(), status=206,
+                        content_type=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    response.content_length = end - start
+    response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{stat.st_size}'
+    response.last_modified = stat.st_mtime
+    return response
+
+
+def send_cached_file(directory, filename):
+    """send_from_directory 的替代：强 ETag、immutable 缓存、单段/多段 Range"""
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    stat = os.stat(path)
+    etag = file_etag(stat)
+
+    range_header = request.headers.get('Range', '')
+    if_range = request.if_range
+    range_applies = ',' in range_header and (if_range.etag is None or if_range.etag == etag) \
+        and if_range.date is None and not request.if_none_match.contains(etag)
+
+    if range_applies and range_header.count(',') < MAX_RANGES:
+        ranges = _parse_ranges(range_header, stat.st_size)
+        if ranges is not None:
+            if not ranges:
+                abort(416)
+            if len(ranges) == 1:
+                response = _single_range_response(path, stat, *ranges[0])
+            else:
+                response = _multipart_ranges_response(path, stat, ranges)
+            return _apply_cache_headers(response, etag)
+
+    # 普通请求与单段 Range 由 Werkzeug 处理（含 If-None-Match / If-Range / 304 / 416）
+    if ',' in range_header:
+        # 无法按多段处理时忽略 Range，返回完整文件
+        request.environ.pop('HTTP_RANGE', None)
+    response = send_from_directory(directory, filename, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+    return _apply_cache_headers(response, etag)
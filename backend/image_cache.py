@@ -0,0 +1,155 @@
+"""按需缩放的图片缓存
+
+/img/<宽>x<高>/<路径> 首次请求时用 Pillow 生成缩放后的图片，写入按总字节数限额的
+磁盘缓存，之后直接从缓存返回。缓存按最近使用淘汰（LRU）：命中时更新文件的
+访问时间（修改时间不变，ETag 也就不变），进程启动后第一次使用时按访问时间重建顺序。
+同一尺寸的并发请求只缩放一次。
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from PIL import Image, ImageOps
+
+# 缩放尺寸上限；宽或高为 0 表示按比例自动计算
+MAX_DIMENSION = 4000
+# 等待其他请求完成同一缩放的最长时间（秒）
+COALESCE_TIMEOUT = 60
+# 源格式 -> (输出格式, 扩展名, 编码参数)
+OUTPUT_FORMATS = {
+    'WEBP': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'JPEG': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DEFAULT_OUTPUT = ('PNG', 'png', {'optimize': True})
+EXIF_ORIENTATION = 0x0112
+# 这些方向旋转 90° 或 270°，显示时宽高互换
+SWAPPED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+class ImageCache:
+    def __init__(self, cache_folder, max_bytes):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self._entries = None      # 相对路径 -> 字节数，按最近使用排序
+        self._total = 0
+        self._lock = threading.Lock()
+        self._inflight = {}       # 缩放结果的哈希 -> Future
+
+    def _load(self):
+        """扫描缓存目录，按访问时间（即最近使用时间）重建 LRU 顺序"""
+        found = []
+        for root, _, files in os.walk(self.cache_folder):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_atime, os.path.relpath(path, self.cache_folder), stat.st_size))
+        found.sort()
+        self._entries = OrderedDict((rel, size) for _, rel, size in found)
+        self._total = sum(size for _, _, size in found)
+
+    def _touch(self, rel):
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            if rel in self._entries:
+                self._entries.move_to_end(rel)
+        path = os.path.join(self.cache_folder, rel)
+        try:
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            pass
+
+    def _add(self, rel, size):
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            self._total += size - self._entries.pop(rel, 0)
+            self._entries[rel] = size
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                victim, victim_size = self._entries.popitem(last=False)
+                self._total -= victim_size
+                try:
+                    os.remove(os.path.join(self.cache_folder, victim))
+                except FileNotFoundError:
+                    pass
+
+    def get(self, source_path, width, height):
+        """返回缓存中缩放后图片的相对路径（不存在时生成）
+
+        无需处理（目标不小于原图且不需按 EXIF 旋转，或是动图）时返回 None，由调用方直接返回原图。
+        """
+        stat = os.stat(source_path)
+        variant = hashlib.sha256(
+            f'{source_path}|{stat.st_size}|{stat.st_mtime_ns}|{width}x{height}'.encode('utf-8')
+        ).hexdigest()
+
+        with self._lock:
+            future = self._inflight.get(variant)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[variant] = future
+
+        if not owner:
+            return future.result(timeout=COALESCE_TIMEOUT)
+
+        try:
+            rel = self._find(variant)
+            if rel is not None:
+                self._touch(rel)
+            else:
+                rel = self._render(source_path, variant, width, height)
+            future.set_result(rel)
+            return rel
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(variant, None)
+
+    def _find(self, variant):
+        for _, ext, _ in list(OUTPUT_FORMATS.values()) + [DEFAULT_OUTPUT]:
+            rel = f'{variant[:2]}/{variant}.{ext}'
+            if os.path.exists(os.path.join(self.cache_folder, rel)):
+                return rel
+        return None
+
+    def _render(self, source_path, variant, width, height):
+        with Image.open(source_path) as image:
+            if getattr(image, 'is_animated', False):
+                return None
+            format_name, ext, options = OUTPUT_FORMATS.get(image.format, DEFAULT_OUTPUT)
+            # 先按文件头中的尺寸和方向判断，不需要缩小也不需要旋转时不解码像素
+            orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+            size = image.size[::-1] if orientation in SWAPPED_ORIENTATIONS else image.size
+            target = (width or size[0], height or size[1])
+            shrink = target[0] < size[0] or target[1] < size[1]
+            if not shrink and orientation == 1:
+                return None
+            image = ImageOps.exif_transpose(image)
+            if shrink:
+                image.thumbnail(target, Image.LANCZOS)
+            if format_name == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            buffer = io.BytesIO()
+            image.save(buffer, format_name, **options)
+
+        rel = f'{variant[:2]}/{variant}.{ext}'
+        path = os.path.join(self.cache_folder, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+        self._add(rel, len(buffer.getvalue()))
+        return rel
@@ -0,0 +1,134 @@
+"""基于 Pillow 的图片处理：书籍封面缩略图、备忘录图片压缩等"""
+import hashlib
+import io
+import os
+import threading
+
+from PIL import Image, ImageOps, ImageSequence
+
+# 封面缩略图尺寸（3:4，按 2 倍像素适配高分屏上 h-48 的封面区域）
+COVER_SIZE = (300, 400)
+# 封面原图大小上限
+MAX_COVER_BYTES = 20 * 1024 * 1024
+COVER_FORMATS = (('webp', 'WEBP', {'quality': 80, 'method': 4}),
+                 ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}))
+
+# 备忘录图片的最长边（编辑器里只显示几百像素宽，按 2 倍像素留足余量）
+NOTE_IMAGE_MAX_SIDE = 1600
+# 备忘录图片原图大小上限
+MAX_IMAGE_BYTES = 30 * 1024 * 1024
+WEBP_OPTIONS = {'quality': 80, 'method': 4}
+JPEG_OPTIONS = {'quality': 82, 'optimize': True, 'progressive': True}
+# 动图每帧的默认时长（毫秒）
+DEFAULT_FRAME_DURATION = 100
+
+
+def _to_rgb(image):
+    """透明背景铺白后转为 RGB，避免 JPEG 无法保存透明通道"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _save_atomic(image, path, format_name, options):
+    # 同一进程的多个线程可能同时生成同一张封面，临时文件按进程和线程区分
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        image.save(tmp_path, format_name, **options)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def cover_relative_path(cover_hash, ext):
+    """封面按内容哈希分目录存放：ab/abcdef....webp"""
+    return f'{cover_hash[:2]}/{cover_hash}.{ext}'
+
+
+def save_cover_thumbnails(stream, cover_folder):
+    """生成 WebP 和 JPEG 两种封面缩略图，返回原图内容的 SHA-256
+
+    文件名由原图内容决定，同一张封面重复上传时直接复用已生成的缩略图。
+    """
+    data = stream.read(MAX_COVER_BYTES + 1)
+    if len(data) > MAX_COVER_BYTES:
+        raise ValueError('封面图片过大')
+    cover_hash = hashlib.sha256(data).hexdigest()
+
+    paths = [(os.path.join(cover_folder, cover_relative_path(cover_hash, ext)), format_name, options)
+             for ext, format_name, options in COVER_FORMATS]
+    if all(os.path.exists(path) for path, _, _ in paths):
+        return cover_hash
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        thumbnail = ImageOps.fit(_to_rgb(image), COVER_SIZE, Image.LANCZOS)
+
+    os.makedirs(os.path.dirname(paths[0][0]), exist_ok=True)
+    for path, format_name, options in paths:
+        _save_atomic(thumbnail, path, format_name, options)
+    return cover_hash
+
+
+def delete_cover_thumbnails(cover_hash, cover_folder):
+    for ext, _, _ in COVER_FORMATS:
+        path = os.path.join(cover_folder, cover_relative_path(cover_hash, ext))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _encode(image, format_name, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format_name, **options)
+    return buffer.getvalue()
+
+
+def _optimize_animated(image, data, max_side):
+    frames = []
+    durations = []
+    for frame in ImageSequence.Iterator(image):
+        durations.append(frame.info.get('duration', DEFAULT_FRAME_DURATION))
+        frame = frame.convert('RGBA')
+        frame.thumbnail((max_side, max_side), Image.LANCZOS)
+        frames.append(frame)
+
+    options = {'save_all': True, 'append_images': frames[1:], 'duration': durations,
+               'loop': image.info.get('loop', 0)}
+    webp = _encode(frames[0], 'WEBP', **options, **WEBP_OPTIONS)
+    # 原图是 GIF 且尺寸没变时兼容格式直接用原文件（GIF 本身不带 EXIF）；
+    # 动态 PNG、动态 WebP 等要重新编码为 GIF，不支持 WebP 的浏览器才能显示，元数据也随之去掉
+    if image.format == 'GIF' and frames[0].size == image.size:
+        fallback = data
+    else:
+        fallback = _encode(frames[0], 'GIF', disposal=2, **options)
+    return [('webp', webp), ('gif', fallback)], frames[0].size
+
+
+def optimize_note_image(data, max_side=NOTE_IMAGE_MAX_SIDE):
+    """压缩备忘录图片，返回 ([(扩展名, 数据), ...], (宽, 高))
+
+    第一项是 WebP，第二项是兼容格式（透明图为 PNG，动图为 GIF，其余为 JPEG）。
+    按 EXIF 方向摆正后重新编码，EXIF 等元数据不会写入输出；最长边不超过 max_side。
+    动图转为动态 WebP。
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if getattr(image, 'is_animated', False):
+            return _optimize_animated(image, data, max_side)
+
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if _has_alpha(image):
+            image = image.convert('RGBA')
+            fallback = ('png', _encode(image, 'PNG', optimize=True))
+        else:
+            image = image.convert('RGB')
+            fallback = ('jpg', _encode(image, 'JPEG', **JPEG_OPTIONS))
+        return [('webp', _encode(image, 'WEBP', **WEBP_OPTIONS)), fallback], image.size
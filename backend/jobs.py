@@ -0,0 +1,222 @@
+"""进程内的后台任务
+
+上传接口只把耗时的后续处理（建索引等）写进 job 表就返回，任务由有界线程池执行。
+任务在事务提交后才提交给线程池，失败按指数退避重试；进程崩溃后，
+状态停在 running 的任务会在下次启动时重新排队。任务记录的是执行进程启动时生成的随机
+编号（BOOT_ID）而不是 PID：容器重启后新进程的 PID 往往和原来相同（常常是 1），
+用 PID 判断会把中断的任务当成仍在运行。按单进程部署设计，其他进程正在执行的任务同样会被重新排队。
+运行中的进度只保存在内存里，供状态查询和 SSE 推送，结束时再写入数据库。
+"""
+import json
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from .models import db, Job
+
+# 同时执行的任务数（索引扫描会占用 CPU，不宜过多，以免拖慢请求）
+MAX_WORKERS = 2
+MAX_ATTEMPTS = 3
+# 第 n 次失败后等待 RETRY_BASE_SECONDS * 2**(n-1) 秒再重试
+RETRY_BASE_SECONDS = 5
+
+_handlers = {}
+_periodic = []   # (kind, 间隔秒数, payload)
+_progress = {}   # job_id -> (progress, message)，只在内存中
+_lock = threading.Lock()
+_app = None
+_executor = None
+_resumed = False
+# 本进程的启动编号，每次启动都不同
+BOOT_ID = uuid.uuid4().hex
+
+
+def handler(kind):
+    """注册任务处理函数：fn(payload, report)，report(progress, message) 汇报进度"""
+    def decorator(fn):
+        _handlers[kind] = fn
+        return fn
+    return decorator
+
+
+def init_app(app):
+    global _app, _executor
+    _app = app
+    _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='job')
+    # 只在真正处理请求的进程里恢复任务（flask 命令行、reloader 父进程都不会执行）
+    app.before_request(_resume_once)
+
+
+def every(kind, seconds, payload=None):
+    """每隔 seconds 秒提交一次任务，和中断任务的恢复一起在处理请求的进程里启动"""
+    _periodic.append((kind, seconds, payload or {}))
+
+
+def _schedule_periodic(kind, seconds, payload):
+    def tick():
+        with _app.app_context():
+            try:
+                # 上一次的任务还没执行完时不再重复提交
+                if not Job.query.filter(Job.kind == kind, Job.status.in_(('pending', 'running'))).first():
+                    enqueue(kind, payload)
+                    db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                _app.logger.warning(f'定时任务 {kind} 提交失败: {e}')
+            finally:
+                db.session.remove()
+        _schedule_periodic(kind, seconds, payload)
+
+    timer = threading.Timer(seconds, tick)
+    timer.daemon = True
+    timer.start()
+
+
+def enqueue(kind, payload):
+    """新建任务，随当前事务一起提交，提交后才开始执行"""
+    job = Job(kind=kind, payload=json.dumps(payload, ensure_ascii=False), status='pending',
+              max_attempts=MAX_ATTEMPTS)
+    db.session.add(job)
+    db.session.flush()
+    db.session.info.setdefault('pending_jobs', []).append(job.id)
+    return job
+
+
+@event.listens_for(Session, 'after_commit')
+def _submit_committed(session):
+    for job_id in session.info.pop('pending_jobs', []):
+        _submit(job_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_uncommitted(session):
+    session.info.pop('pending_jobs', None)
+
+
+def _submit(job_id, delay=0):
+    if _executor is None:
+        return
+    if delay > 0:
+        timer = threading.Timer(delay, _submit, args=(job_id,))
+        timer.daemon = True
+        timer.start()
+        return
+    _executor.submit(_run_in_context, job_id)
+
+
+def _run_in_context(job_id):
+    with _app.app_context():
+        try:
+            _run(job_id)
+        finally:
+            db.session.remove()
+
+
+def _run(job_id):
+    # 用条件更新抢占任务，多个进程/线程同时提交同一任务时只会执行一次
+    claimed = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.status == 'pending')
+        .values(status='running', attempts=Job.attempts + 1, worker_pid=os.getpid(),
+                worker_boot_id=BOOT_ID, started_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return
+
+    job = db.session.get(Job, job_id)
+    fn = _handlers.get(job.kind)
+    _set_progress(job_id, 0, '开始处理')
+    try:
+        if fn is None:
+            raise LookupError(f'未知的任务类型: {job.kind}')
+        result = fn(json.loads(job.payload or '{}'), lambda p, m=None: _set_progress(job_id, p, m))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        _app.logger.warning(f'任务 {job_id} 执行失败: {e}')
+        _finish_failed(job_id, e)
+        return
+    finally:
+        with _lock:
+            _progress.pop(job_id, None)
+
+    job = db.session.get(Job, job_id)
+    job.status = 'done'
+    job.progress = 1.0
+    job.message = '完成'
+    job.result = json.dumps(result, ensure_ascii=False) if result is not None else None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def _finish_failed(job_id, error):
+    job = db.session.get(Job, job_id)
+    job.error = ''.join(traceback.format_exception_only(type(error), error)).strip()[:2000]
+    if job.attempts < job.max_attempts:
+        delay = RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)
+        job.status = 'pending'
+        job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+        job.message = f'{delay} 秒后重试'
+        db.session.commit()
+        _submit(job_id, delay)
+    else:
+        job.status = 'failed'
+        job.message = '失败'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+def _set_progress(job_id, progress, message=None):
+    with _lock:
+        _progress[job_id] = (max(0.0, min(1.0, float(progress))), message)
+
+
+def resume():
+    """把崩溃时中断的任务重新排队，并提交所有待执行的任务"""
+    for job in Job.query.filter_by(status='running').all():
+        if job.worker_boot_id != BOOT_ID:
+            job.status = 'pending'
+            job.message = '进程中断，重新排队'
+    db.session.commit()
+
+    now = datetime.utcnow()
+    for job in Job.query.filter_by(status='pending').all():
+        delay = (job.run_after - now).total_seconds() if job.run_after else 0
+        _submit(job.id, delay)
+
+
+def _resume_once():
+    global _resumed
+    if _resumed:
+        return
+    with _lock:
+        if _resumed:
+            return
+        _resumed = True
+    try:
+        resume()
+    except OperationalError:
+        # 数据库还没有 job 表（未执行迁移）
+        db.session.rollback()
+        return
+    for kind, seconds, payload in _periodic:
+        _schedule_periodic(kind, seconds, payload)
+
+
+def status(job):
+    """任务状态，运行中的进度取内存里的最新值"""
+    data = job.to_dict()
+    with _lock:
+        live = _progress.get(job.id)
+    if live and job.status == 'running':
+        data['progress'], message = live
+        if message:
+            data['message'] = message
+    return data
@@ -0,0 +1,28 @@
+"""add note_fts full-text search table
+
+Revision ID: a7c3e9f15b62
+Revises: 6a1f4b8e3d25
+Create Date: 2026-10-18 21:32:26.940781
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9f15b62'
+down_revision = '6a1f4b8e3d25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 虚拟表无法自动生成，手动创建；已有备忘录用 flask index-notes 补建索引
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5("
+        "note_id UNINDEXED, title, content, tokenize='trigram')"
+    )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS note_fts")
@@ -0,0 +1,64 @@
+"""add blob refs for existing note revisions
+
+Revision ID: b7e2d5a9c341
+Revises: f5c2a8d41e97
+Create Date: 2026-10-19 14:22:51.604317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import json
+import re
+import zlib
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d5a9c341'
+down_revision = 'f5c2a8d41e97'
+branch_labels = None
+depends_on = None
+
+BLOB_URL_PATTERN = re.compile(r'/uploads/blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64}\.[a-z0-9]{1,10})')
+
+
+def _decode(keyframe, data, newer_content):
+    # 与 backend/revisions.py 的编码一致：关键帧是压缩的完整内容，差异是 [行区间或插入文本] 列表
+    if keyframe:
+        return zlib.decompress(data).decode('utf-8')
+    base_lines = newer_content.splitlines(keepends=True)
+    ops = json.loads(zlib.decompress(data).decode('utf-8'))
+    return ''.join(''.join(base_lines[o[0]:o[1]]) if isinstance(o, list) else o for o in ops)
+
+
+def upgrade():
+    # 已有的历史版本逐个还原内容，登记其中引用的图片
+    conn = op.get_bind()
+    known = {row[0] for row in conn.execute(sa.text("SELECT key FROM blob"))}
+    if not known:
+        return
+    note_ids = [row[0] for row in conn.execute(sa.text("SELECT DISTINCT note_id FROM note_revision"))]
+    for note_id in note_ids:
+        content = conn.execute(sa.text("SELECT content FROM note WHERE id = :id"), {'id': note_id}).scalar()
+        content = content or ''
+        rows = conn.execute(sa.text(
+            "SELECT id, keyframe, data FROM note_revision WHERE note_id = :id ORDER BY version DESC"
+        ), {'id': note_id}).fetchall()
+        for revision_id, keyframe, data in rows:
+            content = _decode(keyframe, data, content)
+            for key in set(BLOB_URL_PATTERN.findall(content)) & known:
+                conn.execute(sa.text(
+                    "INSERT OR IGNORE INTO blob_ref (blob_key, owner_type, owner_id, created_at) "
+                    "VALUES (:key, 'revision', :owner_id, CURRENT_TIMESTAMP)"
+                ), {'key': key, 'owner_id': str(revision_id)})
+    op.execute(
+        "UPDATE blob SET ref_count = (SELECT COUNT(*) FROM blob_ref WHERE blob_ref.blob_key = blob.key)"
+    )
+    op.execute("UPDATE blob SET orphaned_at = NULL WHERE ref_count > 0")
+
+
+def downgrade():
+    op.execute("DELETE FROM blob_ref WHERE owner_type = 'revision'")
+    op.execute(
+        "UPDATE blob SET ref_count = (SELECT COUNT(*) FROM blob_ref WHERE blob_ref.blob_key = blob.key)"
+    )
+    op.execute("UPDATE blob SET orphaned_at = CURRENT_TIMESTAMP WHERE ref_count = 0 AND orphaned_at IS NULL")
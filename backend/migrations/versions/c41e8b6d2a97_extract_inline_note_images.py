@@ -0,0 +1,101 @@
+"""extract inline base64 images from note content
+
+Revision ID: c41e8b6d2a97
+Revises: a7c3e9f15b62
+Create Date: 2026-10-18 22:14:51.208334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+
+from flask import current_app
+from PIL import Image, UnidentifiedImageError
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41e8b6d2a97'
+down_revision = 'a7c3e9f15b62'
+branch_labels = None
+depends_on = None
+
+
+BLOB_URL_PATTERN = re.compile(r'/uploads/blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64}\.[a-z0-9]{1,10})')
+DATA_URI_PATTERN = re.compile(r'data:image/([a-zA-Z0-9.+-]+);base64,([A-Za-z0-9+/]+={0,2})')
+# 与 backend/images.py 的 MAX_IMAGE_BYTES 一致，过大的图片保持原样
+MAX_IMAGE_BYTES = 30 * 1024 * 1024
+
+
+def _save_blob(conn, blob_folder, data, subtype):
+    """按内容哈希写入 blob 存储并登记（与 backend/storage.py 的布局一致），返回 blob 键"""
+    ext = ''.join(c for c in subtype.lower() if c.isascii() and c.isalnum())[:10] or 'bin'
+    key = f'{hashlib.sha256(data).hexdigest()}.{ext}'
+    path = os.path.join(blob_folder, key[:2], key[2:4], key)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    conn.execute(sa.text(
+        "INSERT INTO blob (key, size, ref_count, orphaned_at, created_at) "
+        "VALUES (:key, :size, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP) ON CONFLICT (key) DO NOTHING"
+    ), {'key': key, 'size': len(data)})
+    return key
+
+
+def upgrade():
+    # 纯数据迁移：内嵌图片按原始字节存入 blob 存储（不重新压缩为 WebP，之后上传的图片才会压缩），
+    # 不依赖应用代码，只需要 flask db upgrade 提供的应用配置（BLOB_FOLDER）。
+    #
+    # 改写后的内容直接更新，不增加版本号、不记入历史版本：图片不变，只是 data URI 换成了地址，
+    # 旧内容作为历史版本只会多存一份 base64 数据；替换不跨行，已有历史版本按行记录的反向差异
+    # 仍然适用于改写后的内容。图片在 Markdown 图片语法或标签中，纯文本摘要和全文索引也不变。
+    blob_folder = current_app.config['BLOB_FOLDER']
+    conn = op.get_bind()
+    rows = conn.execute(sa.text(
+        "SELECT id, content FROM note WHERE content LIKE '%data:image/%'"
+    )).fetchall()
+    for note_id, content in rows:
+        saved = {}
+
+        def replace(match):
+            subtype, encoded = match.groups()
+            if encoded not in saved:
+                saved[encoded] = None
+                if len(encoded) * 3 // 4 <= MAX_IMAGE_BYTES:
+                    try:
+                        data = base64.b64decode(encoded, validate=True)
+                        with Image.open(io.BytesIO(data)) as image:
+                            image.verify()
+                    except (binascii.Error, ValueError, UnidentifiedImageError, OSError):
+                        return match.group(0)
+                    key = _save_blob(conn, blob_folder, data, subtype)
+                    saved[encoded] = f'/uploads/blobs/{key[:2]}/{key[2:4]}/{key}'
+            return saved[encoded] or match.group(0)
+
+        content = DATA_URI_PATTERN.sub(replace, content)
+        if not any(saved.values()):
+            continue
+        conn.execute(sa.text("UPDATE note SET content = :content WHERE id = :id"),
+                     {'content': content, 'id': note_id})
+        keys = set(BLOB_URL_PATTERN.findall(content))
+        for key in keys:
+            conn.execute(sa.text(
+                "INSERT OR IGNORE INTO blob_ref (blob_key, owner_type, owner_id, created_at) "
+                "SELECT key, 'note', :note_id, CURRENT_TIMESTAMP FROM blob WHERE key = :key"
+            ), {'key': key, 'note_id': note_id})
+            conn.execute(sa.text(
+                "UPDATE blob SET ref_count = (SELECT COUNT(*) FROM blob_ref WHERE blob_key = :key), "
+                "orphaned_at = NULL WHERE key = :key"
+            ), {'key': key})
+
+
+def downgrade():
+    # 图片已存入 blob 存储，内容中的地址仍然有效，无需还原
+    pass
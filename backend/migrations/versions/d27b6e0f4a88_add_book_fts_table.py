@@ -0,0 +1,28 @@
+"""add book_fts full-text search table
+
+Revision ID: d27b6e0f4a88
+Revises: 8c4e2a91d5f3
+Create Date: 2026-10-18 13:41:09.377215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd27b6e0f4a88'
+down_revision = '8c4e2a91d5f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 虚拟表无法自动生成，手动创建；已有书籍可用 flask index-books --force 补建索引
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS book_fts USING fts5("
+        "content, start_offset UNINDEXED, tokenize='trigram')"
+    )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS book_fts")
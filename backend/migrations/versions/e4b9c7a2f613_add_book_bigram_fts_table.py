@@ -0,0 +1,47 @@
+"""add book_bigram_fts table for two-character search terms
+
+Revision ID: e4b9c7a2f613
+Revises: d25f7a3c8e41
+Create Date: 2026-10-19 09:12:40.581127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b9c7a2f613'
+down_revision = 'd25f7a3c8e41'
+branch_labels = None
+depends_on = None
+
+BATCH = 200
+
+
+def _bigrams(content):
+    # 与 backend/search.py 的 bigrams() 相同（迁移不依赖应用代码）；删除时要求写入的内容完全一致
+    return ' '.join(content[i:i + 2] for i in range(len(content) - 1)
+                    if content[i].isalnum() and content[i + 1].isalnum())
+
+
+def upgrade():
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS book_bigram_fts USING fts5("
+        "content, content='', detail=none)"
+    )
+    # 为已索引的书籍页补建二元组索引
+    conn = op.get_bind()
+    last = -1
+    while True:
+        rows = conn.execute(sa.text(
+            "SELECT rowid, content FROM book_fts WHERE rowid > :last ORDER BY rowid LIMIT :batch"
+        ), {'last': last, 'batch': BATCH}).all()
+        if not rows:
+            break
+        conn.execute(sa.text("INSERT INTO book_bigram_fts (rowid, content) VALUES (:rowid, :content)"),
+                     [{'rowid': rowid, 'content': _bigrams(content)} for rowid, content in rows])
+        last = rows[-1][0]
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS book_bigram_fts")
@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import json
 
 # 直接创建db实例，而不是从其他模块导入
 db = SQLAlchemy()
@@ -10,6 +11,25 @@ class PDFBook(db.Model):
     file_path = db.Column(db.String(500), nullable=False)  # 存储后端实际的文件名
     file_type = db.Column(db.String(10), default='pdf')   # ✅ 新增：文件类型 (pdf/txt)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
+    file_size = db.Column(db.Integer)                     # 文件大小（字节）
+    page_count = db.Column(db.Integer)                    # 页数（PDF 为实际页数，TXT 为分页索引的页数）
+    # TXT 分页索引：每页起始字节偏移与起始行号（array 打包后的二进制）
+    line_count = db.Column(db.Integer)
+    page_offsets = db.Column(db.LargeBinary)
+    page_lines = db.Column(db.LargeBinary)
+
+    # PDF 结构信息（上传时扫描）
+    is_linearized = db.Column(db.Boolean)   # 是否线性化（可按 Range 边下载边显示）
+    has_text_layer = db.Column(db.Boolean)  # 是否有文字层（扫描版为 False）
+    outline = db.Column(db.Text)            # 书签目录 JSON
+    xref_offset = db.Column(db.Integer)     # 最后一个交叉引用表的偏移
+
+    # 封面缩略图：原图内容的 SHA-256，缩略图按哈希存放在 uploads/covers 下
+    cover_hash = db.Column(db.String(64))
+
+    # TXT 章节目录
+    chapters = db.relationship('BookChapter', backref='book', lazy=True, cascade="all, delete-orphan",
+                               order_by='BookChapter.chapter_no')
 
     def to_dict(self):
         return {
@@ -17,7 +37,37 @@ class PDFBook(db.Model):
             'title': self.title,
             'date': self.upload_date.strftime('%Y-%m-%d'),
             'file_path': self.file_path,
-            'file_type': self.file_type  # ✅ 返回 file_type
+            'file_type': self.file_type,  # ✅ 返回 file_type
+            'page_count': self.page_count,
+            'file_size': self.file_size,
+            'linearized': self.is_linearized,
+            'has_text_layer': self.has_text_layer,
+            'has_outline': bool(self.outline),
+            'cover_url': f'/uploads/covers/{self.cover_hash[:2]}/{self.cover_hash}.webp' if self.cover_hash else None,
+            'cover_fallback_url': f'/uploads/covers/{self.cover_hash[:2]}/{self.cover_hash}.jpg' if self.cover_hash else None
+        }
+
+class BookChapter(db.Model):
+    """TXT 书籍的章节目录（标题与字节偏移）"""
+    id = db.Column(db.Integer, primary_key=True)
+    book_id = db.Column(db.Integer, db.ForeignKey('pdf_book.id'), nullable=False)
+    chapter_no = db.Column(db.Integer, nullable=False)  # 章节序号，从 1 开始
+    title = db.Column(db.String(200), nullable=False)
+    start_offset = db.Column(db.Integer, nullable=False)  # 章节起始字节偏移
+    end_offset = db.Column(db.Integer, nullable=False)    # 章节结束字节偏移（不含）
+    page = db.Column(db.Integer)                          # 章节所在页码，从 1 开始
+
+    __table_args__ = (
+        db.UniqueConstraint('book_id', 'chapter_no', name='uq_book_chapter_no'),
+    )
+
+    def to_dict(self):
+        return {
+            'chapter_no': self.chapter_no,
+            'title': self.title,
+            'offset': self.start_offset,
+            'length': self.end_offset - self.start_offset,
+            'page': self.page
         }
 
 class Bookmark(db.Model):
@@ -40,6 +90,9 @@ class Conversation(db.Model):
     title = db.Column(db.String(100), nullable=False)  # 对话标题（可从首条消息生成）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # 较早消息的滚动摘要，覆盖到 summary_message_id（含）为止的消息
+    summary = db.Column(db.Text)
+    summary_message_id = db.Column(db.Integer)
     
     # 关联的消息
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade="all, delete-orphan")
@@ -60,6 +113,10 @@ class Message(db.Model):
     role = db.Column(db.String(20), nullable=False)  # 'user' 或 'ai'
     content = db.Column(db.Text, nullable=False)     # 消息内容
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_message_conversation_id_id', 'conversation_id', 'id'),
+    )
     
     def to_dict(self):
         return {
@@ -74,18 +131,70 @@ class Note(db.Model):
     id = db.Column(db.String(36), primary_key=True)  # UUID长度为36
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, default='')
+    snippet = db.Column(db.String(200), default='')  # 纯文本摘要，写入时生成，列表只返回它
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # 每次保存加一，用于增量保存的冲突检测
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # 列表按 (updated_at, id) 倒序做游标分页
+    __table_args__ = (
+        db.Index('ix_note_updated_at_id', 'updated_at', 'id'),
+    )
     
     def to_dict(self):
         return {
             'id': self.id,
             'title': self.title,
             'content': self.content,
+            'snippet': self.snippet,
+            'version': self.version,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
             'last_edited': self.updated_at.strftime('%Y-%m-%d %H:%M')  # 适配前端显示格式
         }
+
+    def to_summary_dict(self):
+        """列表用的摘要，不含正文"""
+        return {
+            'id': self.id,
+            'title': self.title,
+            'snippet': self.snippet,
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat(),
+            'last_edited': self.updated_at.strftime('%Y-%m-%d %H:%M')
+        }
+
+
+class NoteRevision(db.Model):
+    """备忘录的历史版本
+
+    data 是 zlib 压缩后的内容：关键帧保存完整内容，其余保存反向差异
+    （由更新一个的历史版本——最新的则是备忘录当前内容——还原出本版本），
+    见 revisions.py。
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    note_id = db.Column(db.String(36), nullable=False)
+    version = db.Column(db.Integer, nullable=False)   # 这份内容对应的备忘录版本号
+    title = db.Column(db.String(200), nullable=False)
+    keyframe = db.Column(db.Boolean, nullable=False, default=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    content_length = db.Column(db.Integer, nullable=False, default=0)  # 还原后的字符数
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)  # 这份内容被覆盖的时间
+
+    __table_args__ = (
+        db.UniqueConstraint('note_id', 'version', name='uq_note_revision'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'note_id': self.note_id,
+            'version': self.version,
+            'title': self.title,
+            'content_length': self.content_length,
+            'created_at': self.created_at.isoformat(),
+            'saved_at': self.created_at.strftime('%Y-%m-%d %H:%M')
+        }
     
 # 新增工作记录模型
 class WorkRecord(db.Model):
@@ -138,4 +247,90 @@ class AIConfig(db.Model):
             'model_type': self.model_type,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M'),
             'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M')
-        }
\ No newline at end of file
+        }
+# 内容寻址存储的文件记录（按 SHA-256 去重，无人引用超过宽限期后删除文件）
+class Blob(db.Model):
+    key = db.Column(db.String(80), primary_key=True)  # <sha256>.<扩展名>
+    size = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # blob_ref 中的引用数
+    orphaned_at = db.Column(db.DateTime, index=True)  # 引用数归零的时间，有引用时为空
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'size': self.size,
+            'ref_count': self.ref_count,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+# blob 引用记录：哪个书籍/游戏/备忘录（或派生出兼容格式的图片）用到了哪个 blob
+class BlobRef(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    blob_key = db.Column(db.String(80), nullable=False, index=True)
+    owner_type = db.Column(db.String(10), nullable=False)  # 'book'/'game'/'note'/'revision'/'blob'
+    owner_id = db.Column(db.String(80), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('owner_type', 'owner_id', 'blob_key', name='uq_blob_ref'),
+    )
+
+# 可续传的分块上传会话（数据写在 blob 存储的临时目录下）
+class UploadSession(db.Model):
+    id = db.Column(db.String(32), primary_key=True)  # UUID hex
+    kind = db.Column(db.String(10), nullable=False)  # 'book' 或 'game'
+    filename = db.Column(db.String(255), nullable=False)
+    file_ext = db.Column(db.String(10), nullable=False)
+    total_size = db.Column(db.Integer, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    received_bytes = db.Column(db.Integer, nullable=False, default=0)
+    sha256 = db.Column(db.String(64))   # 客户端提供的整个文件的哈希（可选）
+    params = db.Column(db.Text)         # 完成后处理所需的参数 JSON（标题、编码等）
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'kind': self.kind,
+            'filename': self.filename,
+            'size': self.total_size,
+            'chunk_size': self.chunk_size,
+            'offset': self.received_bytes,
+            'next_chunk': self.received_bytes // self.chunk_size,
+            'complete': self.received_bytes >= self.total_size
+        }
+
+# 后台任务（上传后的索引等耗时处理）
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text)                     # 任务参数 JSON
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)  # pending/running/done/failed
+    progress = db.Column(db.Float, default=0.0)
+    message = db.Column(db.String(200))
+    result = db.Column(db.Text)                      # 结果 JSON
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    worker_pid = db.Column(db.Integer)               # 执行任务的进程（仅供排查）
+    worker_boot_id = db.Column(db.String(32))        # 执行任务的进程启动时生成的随机编号，用于启动时判断任务是否中断
+    run_after = db.Column(db.DateTime)               # 重试前的等待截止时间
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress or 0.0,
+            'message': self.message,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None
+        }
@@ -0,0 +1,151 @@
+"""备忘录自动保存的写缓冲（可选，NOTE_WRITE_BEHIND=true 时启用）
+
+自动保存每秒都可能提交一次，每次提交 SQLite 都要刷盘，多开几个标签页时更多。
+启用后 PUT/PATCH 保存只更新内存中该备忘录的最新状态（多次保存合并为一次），
+每 NOTE_FLUSH_SECONDS 秒在一个事务中写入数据库。读取备忘录（列表、单条、检索、
+历史版本）前先写入缓冲，进程退出（atexit、SIGTERM）时也会写入。
+
+版本号照常逐次增加，冲突检测基于缓冲中的最新版本。只适合单进程部署：多个进程各自
+缓冲同一条备忘录时，后写入数据库的会覆盖先写入的。
+"""
+import atexit
+import os
+import signal
+import threading
+from datetime import datetime
+
+from . import notes
+from .models import db, Note
+
+DEFAULT_FLUSH_SECONDS = 10
+
+_pending = {}   # note_id -> 缓冲中的最新状态
+# 保存和写入数据库都持有这把锁：写入期间的保存要等写入完成，才能以数据库中的新版本为基础
+_lock = threading.RLock()
+_app = None
+_timer = None
+
+
+def init_app(app):
+    global _app
+    _app = app
+    if not enabled():
+        return
+    atexit.register(_flush_at_exit)
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, lambda signum, frame: _on_sigterm(previous, signum, frame))
+    except ValueError:
+        pass  # 不在主线程中（如被其他程序导入），只依赖 atexit
+
+
+def enabled():
+    return _app is not None and _app.config.get('NOTE_WRITE_BEHIND', False)
+
+
+def save(note, expected_version=None, title=None, content=None, ops=None):
+    """缓冲一次保存，返回 (是否成功, 状态)
+
+    状态为 {title, content, version, base_version, updated_at}，冲突时返回当前状态；
+    ops 为增量保存的编辑操作，无法应用时抛出 ValueError。
+    """
+    with _lock:
+        state = _pending.get(note.id)
+        if state is None:
+            # 以数据库中的最新内容为基础（note 可能是在上一次写入之前查询的）
+            db.session.refresh(note)
+            state = {'title': note.title, 'content': note.content or '', 'version': note.version,
+                     'base_version': note.version, 'updated_at': note.updated_at}
+        if expected_version is not None and expected_version != state['version']:
+            return False, state
+        if ops is not None:
+            content = notes.apply_patch(state['content'], ops)
+        state = dict(state, version=state['version'] + 1, updated_at=datetime.utcnow())
+        if title is not None:
+            state['title'] = title
+        if content is not None:
+            state['content'] = content
+        _pending[note.id] = state
+        _schedule()
+    return True, state
+
+
+def as_note(note, state):
+    """把缓冲中的状态转成 Note 对象（不加入会话），接口按原来的格式返回"""
+    return Note(id=note.id, title=state['title'], content=state['content'],
+                snippet=notes.make_snippet(state['content']), version=state['version'],
+                created_at=note.created_at, updated_at=state['updated_at'])
+
+
+def discard(note_id):
+    with _lock:
+        _pending.pop(note_id, None)
+
+
+def flush(note_id=None):
+    """把缓冲的保存写入数据库（note_id 为空时写入全部），返回写入的备忘录数"""
+    with _lock:
+        if note_id is None:
+            entries = dict(_pending)
+        else:
+            entries = {note_id: _pending[note_id]} if note_id in _pending else {}
+        if not entries:
+            return 0
+        try:
+            for pending_id, state in entries.items():
+                note = db.session.get(Note, pending_id, populate_existing=True)
+                if note is None:
+                    continue  # 写入前已被删除
+                if not notes.write(note, state['title'], state['content'], state['base_version'],
+                                   version=state['version'], updated_at=state['updated_at']):
+                    # 数据库中的内容被缓冲之外的写入改过，以缓冲中的最新编辑为准
+                    _app.logger.warning(f'备忘录 {pending_id} 写入缓冲时版本冲突，覆盖数据库中的内容')
+                    notes.write(note, state['title'], state['content'], updated_at=state['updated_at'])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for pending_id in entries:
+            del _pending[pending_id]
+        return len(entries)
+
+
+def _schedule():
+    global _timer
+    if _timer is None:
+        _timer = threading.Timer(_app.config.get('NOTE_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS), _flush_in_context)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _flush_in_context():
+    global _timer
+    with _lock:
+        _timer = None
+    with _app.app_context():
+        try:
+            flush()
+        except Exception as e:
+            _app.logger.warning(f'写入备忘录缓冲失败，稍后重试: {e}')
+            with _lock:
+                _schedule()
+        finally:
+            db.session.remove()
+
+
+def _flush_at_exit():
+    with _app.app_context():
+        try:
+            flush()
+        finally:
+            db.session.remove()
+
+
+def _on_sigterm(previous, signum, frame):
+    _flush_at_exit()
+    if callable(previous):
+        previous(signum, frame)
+    elif previous != signal.SIG_IGN:
+        # 恢复默认处理并重新发送信号，进程照常退出
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
@@ -0,0 +1,179 @@
+"""备忘录相关的工具：保存、列表摘要、分页游标、增量保存等"""
+import base64
+import binascii
+import hashlib
+import io
+import re
+from datetime import datetime
+
+from flask import current_app
+from PIL import Image, UnidentifiedImageError
+from sqlalchemy import update
+
+from . import images, revisions, search, storage
+from .models import db, Note
+
+# 列表摘要的最大字符数
+SNIPPET_CHARS = 120
+# 列表每页条数
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# 一次增量保存最多包含的编辑操作数
+MAX_PATCH_OPS = 1000
+
+_IMAGE_PATTERN = re.compile(r'!\[([^\]]*)\]\([^)]*\)')
+_LINK_PATTERN = re.compile(r'\[([^\]]*)\]\([^)]*\)')
+_TAG_PATTERN = re.compile(r'<[^>]+>')
+_MARKUP_PATTERN = re.compile(r'^\s{0,3}(#{1,6}\s+|>\s?|[-*+]\s+|\d+\.\s+)|[*_`~]+', re.MULTILINE)
+_SPACE_PATTERN = re.compile(r'\s+')
+# 内容中内嵌的 base64 图片（粘贴图片时部分编辑器会直接写入 data URI）
+_DATA_URI_PATTERN = re.compile(r'data:image/([a-zA-Z0-9.+-]+);base64,([A-Za-z0-9+/]+={0,2})')
+
+
+def plain_text(content):
+    """去掉 Markdown/HTML 标记，只保留文字（图片只保留说明文字），空白合并为一个空格"""
+    text = content or ''
+    text = _IMAGE_PATTERN.sub(lambda m: f'[{m.group(1)}]' if m.group(1) else '', text)
+    text = _LINK_PATTERN.sub(r'\1', text)
+    text = _TAG_PATTERN.sub(' ', text)
+    text = _MARKUP_PATTERN.sub('', text)
+    return _SPACE_PATTERN.sub(' ', text).strip()
+
+
+def make_snippet(content, limit=SNIPPET_CHARS):
+    """把 Markdown/HTML 内容转成一行纯文本摘要"""
+    text = plain_text(content)
+    if len(text) > limit:
+        text = text[:limit - 1] + '…'
+    return text
+
+
+def encode_cursor(updated_at, note_id):
+    raw = f'{updated_at.isoformat()}|{note_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析分页游标，返回 (updated_at, id)；格式错误抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        updated_at, note_id = raw.split('|', 1)
+        return datetime.fromisoformat(updated_at), note_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('分页游标无效') from e
+
+
+def apply_patch(content, ops):
+    """按顺序把编辑操作应用到 content 上，返回新内容
+
+    每个操作为 {"at": 位置, "delete": 删除长度, "insert": 插入文本}，位置相对于上一个操作
+    应用后的文本，按 UTF-16 码元计算（与浏览器中字符串的下标一致）。操作不合法时抛出 ValueError。
+    """
+    if not isinstance(ops, list) or len(ops) > MAX_PATCH_OPS:
+        raise ValueError('编辑操作格式错误')
+    # UTF-16 下每个码元两个字节，字节下标 = 码元下标 * 2
+    text = bytearray((content or '').encode('utf-16-le'))
+    for op in ops:
+        if not isinstance(op, dict):
+            raise ValueError('编辑操作格式错误')
+        at, length, insert = op.get('at'), op.get('delete', 0), op.get('insert', '')
+        if not all(isinstance(n, int) and not isinstance(n, bool) and n >= 0 for n in (at, length)) \
+                or not isinstance(insert, str):
+            raise ValueError('编辑操作格式错误')
+        if (at + length) * 2 > len(text):
+            raise ValueError('编辑位置超出内容范围')
+        text[at * 2:(at + length) * 2] = insert.encode('utf-16-le', errors='surrogatepass')
+    try:
+        return text.decode('utf-16-le')
+    except UnicodeDecodeError as e:
+        # 操作把代理对（如 emoji）拆开了
+        raise ValueError('编辑位置不在字符边界上') from e
+
+
+def write(note, title=None, content=None, expected_version=None, version=None, updated_at=None):
+    """保存备忘录并更新版本号（默认加一），被覆盖的内容记入历史版本
+
+    用带条件的 UPDATE 检查版本，并发保存同一版本时只有一个会成功。指定 expected_version
+    时版本不一致返回 False，调用方回滚后返回 409；未指定时（完整保存）以最新内容为准重试。
+    """
+    values = {'version': Note.version + 1 if version is None else version,
+              'updated_at': updated_at or datetime.utcnow()}
+    if title is not None:
+        values['title'] = title
+    if content is not None:
+        values['content'] = content
+        values['snippet'] = make_snippet(content)
+    while True:
+        # note 中的内容和版本来自同一次查询，版本一致时它就是被覆盖的内容
+        current = note.version if expected_version is None else expected_version
+        stmt = update(Note).where(Note.id == note.id, Note.version == current).values(**values)
+        if db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount:
+            break
+        if expected_version is not None:
+            return False
+        db.session.refresh(note)
+    old_content = note.content or ''
+    new_content = old_content if content is None else content
+    revisions.record(note, note.title, old_content, new_content)
+    search.index_note(note.id, note.title if title is None else title, plain_text(new_content))
+    if content is not None:
+        # 只解析这一条备忘录的内容，增量更新图片引用
+        storage.set_refs('note', note.id, storage.keys_in_text(content))
+    db.session.expire(note)
+    return True
+
+
+def save_image(data, original_ext='bin'):
+    """保存备忘录图片：摆正方向、去掉 EXIF、限制尺寸后存为 WebP 和兼容格式（均按内容哈希存储）
+
+    返回 {url, fallback_url, width, height}（保留原图时还有 original_url），
+    图片无法识别或像素过多（解压炸弹）时抛出 ValueError。
+    """
+    try:
+        variants, (width, height) = images.optimize_note_image(data)
+    except Image.DecompressionBombError:
+        raise ValueError('图片像素过多')
+    except (UnidentifiedImageError, OSError):
+        raise ValueError('无法识别的图片')
+
+    keys = [storage.save_stream(io.BytesIO(content), ext) for ext, content in variants]
+    saved = {
+        'url': storage.blob_url(keys[0]),
+        'fallback_url': storage.blob_url(keys[1]),
+        'width': width,
+        'height': height
+    }
+    # 默认不保留原图（配置 KEEP_ORIGINAL_IMAGES=true 时保留）
+    if current_app.config['KEEP_ORIGINAL_IMAGES']:
+        original_key = storage.save_stream(io.BytesIO(data), original_ext)
+        saved['original_url'] = storage.blob_url(original_key)
+        keys.append(original_key)
+    # 备忘录里只写 WebP 的地址，兼容格式和原图挂在 WebP 下，随它一起保留或回收
+    storage.add_refs('blob', keys[0], keys[1:])
+    return saved
+
+
+def extract_inline_images(text):
+    """把文本中内嵌的 base64 图片存入 blob 存储并改写为图片地址，返回 (新文本, 提取个数)
+
+    无法解码、无法识别或过大的图片保持原样。
+    """
+    if 'data:image/' not in (text or ''):
+        return text, 0
+    saved = {}  # 同一张图片在一次保存中只处理一次
+
+    def replace(match):
+        subtype, encoded = match.groups()
+        digest = hashlib.sha256(encoded.encode('ascii')).hexdigest()
+        if digest not in saved:
+            saved[digest] = None
+            if len(encoded) * 3 // 4 <= images.MAX_IMAGE_BYTES:
+                try:
+                    data = base64.b64decode(encoded, validate=True)
+                    saved[digest] = save_image(data, storage.normalize_ext(f'image.{subtype}'))['url']
+                except (binascii.Error, ValueError, Image.DecompressionBombError) as e:
+                    current_app.logger.warning(f'内嵌图片无法提取: {e}')
+        return saved[digest] or match.group(0)
+
+    text = _DATA_URI_PATTERN.sub(replace, text)
+    return text, sum(1 for url in saved.values() if url)
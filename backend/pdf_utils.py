@@ -0,0 +1,646 @@
+"""PDF 文件结构检查工具（纯 Python，不依赖第三方库）
+
+上传时用 mmap 按需读取 PDF 的交叉引用表和少量对象，提取页数、书签目录、
+是否有文字层等信息写入数据库，书架和阅读器不必下载解析整个文件就能展示这些内容。
+支持传统 xref 表、xref 流、对象流以及增量更新；交叉引用损坏时退回全文扫描对象头。
+"""
+import mmap
+import re
+import zlib
+from collections import namedtuple
+
+# 线性化字典必须是文件中的第一个对象，规范要求它出现在前 1024 字节内
+LINEARIZATION_WINDOW = 1024
+_LINEARIZED_DICT = re.compile(rb'\d+\s+\d+\s+obj\s*<<(.*?)>>', re.S)
+_LINEARIZED_LENGTH = re.compile(rb'/L\s+(\d+)')
+
+# 检查文字层时最多看前几页
+TEXT_LAYER_SAMPLE_PAGES = 10
+# 书签目录的上限，防止畸形文件导致无限展开
+MAX_OUTLINE_ITEMS = 5000
+MAX_OUTLINE_DEPTH = 12
+MAX_PAGES = 100000
+# 解压对象流和交叉引用流的输出上限，防止很小的畸形文件解压出巨量数据
+MAX_STREAM_BYTES = 8 * 1024 * 1024
+
+_WHITESPACE = b'\x00\t\n\x0c\r '
+_DELIMITERS = b'()<>[]{}/%'
+_REF = re.compile(rb'(\d+)\s+(\d+)\s+R')
+_NUMBER = re.compile(rb'[+-]?(\d+\.?\d*|\.\d+)')
+_OBJ_HEADER = re.compile(rb'(\d+)\s+(\d+)\s+obj')
+_OBJ_SCAN = re.compile(rb'(?<![0-9])(\d+)\s+(\d+)\s+obj\b')
+_STARTXREF = re.compile(rb'startxref\s+(\d+)')
+_XREF_ENTRY = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+_STRING_ESCAPES = {
+    ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b', ord('f'): b'\f',
+    ord('('): b'(', ord(')'): b')', ord('\\'): b'\\',
+}
+
+Ref = namedtuple('Ref', 'num gen')
+
+
+class Name(str):
+    """PDF 名字对象（/Type 之类），与普通字符串区分"""
+
+
+class Stream:
+    def __init__(self, attrs, raw):
+        self.attrs = attrs
+        self.raw = raw
+
+
+class PDFSyntaxError(Exception):
+    pass
+
+
+def is_linearized(file_path, file_size):
+    """判断 PDF 是否线性化（Fast Web View），线性化的文件可以边下载边显示首页
+
+    除了检查首个对象中的 /Linearized 标记，还要求其中记录的 /L 文件长度
+    与实际大小一致——增量保存过的文件长度会变化，线性化信息随之失效。
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(LINEARIZATION_WINDOW)
+
+    match = _LINEARIZED_DICT.search(head)
+    if not match or b'/Linearized' not in match.group(1):
+        return False
+    length = _LINEARIZED_LENGTH.search(match.group(1))
+    return bool(length) and int(length.group(1)) == file_size
+
+
+def _skip_whitespace(data, pos):
+    length = len(data)
+    while pos < length:
+        c = data[pos]
+        if c in _WHITESPACE:
+            pos += 1
+        elif c == 0x25:  # % 注释
+            while pos < length and data[pos] not in b'\r\n':
+                pos += 1
+        else:
+            break
+    return pos
+
+
+def _read_token(data, pos):
+    end = pos
+    length = len(data)
+    while end < length and data[end] not in _WHITESPACE and data[end] not in _DELIMITERS:
+        end += 1
+    return bytes(data[pos:end]), end
+
+
+def _parse_literal_string(data, pos):
+    # pos 指向 '(' 之后
+    out = bytearray()
+    depth = 1
+    length = len(data)
+    while pos < length:
+        c = data[pos]
+        if c == 0x5C:  # 反斜杠转义
+            pos += 1
+            if pos >= length:
+                break
+            c = data[pos]
+            if c in _STRING_ESCAPES:
+                out += _STRING_ESCAPES[c]
+                pos += 1
+            elif 0x30 <= c <= 0x37:
+                digits = bytes(data[pos:pos + 3])
+                n = 0
+                while n < len(digits) and 0x30 <= digits[n] <= 0x37:
+                    n += 1
+                out.append(int(digits[:n], 8) & 0xFF)
+                pos += n
+            elif c in b'\r\n':
+                # 行尾续行
+                pos += 2 if data[pos:pos + 2] == b'\r\n' else 1
+            else:
+                out.append(c)
+                pos += 1
+            continue
+        if c == 0x28:
+            depth += 1
+        elif c == 0x29:
+            depth -= 1
+            if depth == 0:
+                return bytes(out), pos + 1
+        out.append(c)
+        pos += 1
+    raise PDFSyntaxError('unterminated string')
+
+
+def _parse_name(data, pos):
+    raw, end = _read_token(data, pos + 1)
+    if b'#' in raw:
+        raw = re.sub(rb'#([0-9A-Fa-f]{2})', lambda m: bytes([int(m.group(1), 16)]), raw)
+    return Name(raw.decode('latin-1')), end
+
+
+def parse_object(data, pos):
+    """从 pos 处解析一个 PDF 对象，返回 (对象, 结束位置)"""
+    pos = _skip_whitespace(data, pos)
+    if pos >= len(data):
+        raise PDFSyntaxError('unexpected end of data')
+    c = data[pos]
+
+    if c == 0x3C:  # <
+        if data[pos + 1:pos + 2] == b'<':
+            result = {}
+            pos += 2
+            while True:
+                pos = _skip_whitespace(data, pos)
+                if data[pos:pos + 2] == b'>>':
+                    return result, pos + 2
+                if data[pos] != 0x2F:
+                    raise PDFSyntaxError('dictionary key is not a name')
+                key, pos = _parse_name(data, pos)
+                value, pos = parse_object(data, pos)
+                result[key] = value
+        end = data.find(b'>', pos)
+        if end < 0:
+            raise PDFSyntaxError('unterminated hex string')
+        hex_digits = re.sub(rb'[^0-9A-Fa-f]', b'', bytes(data[pos + 1:end]))
+        if len(hex_digits) % 2:
+            hex_digits += b'0'
+        return bytes.fromhex(hex_digits.decode('ascii')), end + 1
+
+    if c == 0x5B:  # [
+        result = []
+        pos += 1
+        while True:
+            pos = _skip_whitespace(data, pos)
+            if pos >= len(data):
+                raise PDFSyntaxError('unterminated array')
+            if data[pos] == 0x5D:
+                return result, pos + 1
+            value, pos = parse_object(data, pos)
+            result.append(value)
+
+    if c == 0x28:  # (
+        return _parse_literal_string(data, pos + 1)
+
+    if c == 0x2F:  # /
+        return _parse_name(data, pos)
+
+    if c in b'+-.0123456789':
+        ref = _REF.match(data, pos)
+        if ref:
+            return Ref(int(ref.group(1)), int(ref.group(2))), ref.end()
+        number = _NUMBER.match(data, pos)
+        if not number:
+            raise PDFSyntaxError('bad number')
+        text = number.group(0)
+        if b'.' in text:
+            return float(text), number.end()
+        return int(text), number.end()
+
+    token, end = _read_token(data, pos)
+    if token == b'true':
+        return True, end
+    if token == b'false':
+        return False, end
+    if token == b'null':
+        return None, end
+    raise PDFSyntaxError(f'unexpected token {token[:20]!r}')
+
+
+def _png_unpredict(data, columns, colors=1, bits=8):
+    """处理 xref 流常用的 PNG 预测器（/Predictor >= 10）"""
+    bpp = max(1, colors * bits // 8)
+    row_length = (columns * colors * bits + 7) // 8
+    out = bytearray()
+    prev = bytearray(row_length)
+    pos = 0
+    while pos < len(data):
+        filter_type = data[pos]
+        row = bytearray(data[pos + 1:pos + 1 + row_length])
+        row.extend(b'\x00' * (row_length - len(row)))
+        for i in range(row_length):
+            left = row[i - bpp] if i >= bpp else 0
+            up = prev[i]
+            if filter_type == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif filter_type == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif filter_type == 3:
+                row[i] = (row[i] + ((left + up) >> 1)) & 0xFF
+            elif filter_type == 4:
+                up_left = prev[i - bpp] if i >= bpp else 0
+                p = left + up - up_left
+                pa, pb, pc = abs(p - left), abs(p - up), abs(p - up_left)
+                predictor = left if pa <= pb and pa <= pc else (up if pb <= pc else up_left)
+                row[i] = (row[i] + predictor) & 0xFF
+        out += row
+        prev = row
+        pos += row_length + 1
+    return bytes(out)
+
+
+class PDFScanner:
+    """只读访问 PDF 对象的最小实现"""
+
+    def __init__(self, data):
+        self.data = data
+        self.xref = {}       # 对象号 -> ('offset', 偏移) 或 ('stream', 对象流号, 序号)
+        self.trailer = {}
+        self.xref_offset = None
+        self._cache = {}
+        self._objstm_cache = {}
+        self._load_xref()
+
+    # ---------- 交叉引用 ----------
+
+    def _load_xref(self):
+        tail = self.data[max(0, len(self.data) - 2048):]
+        matches = list(_STARTXREF.finditer(tail))
+        try:
+            if not matches:
+                raise PDFSyntaxError('startxref not found')
+            self.xref_offset = int(matches[-1].group(1))
+            self._read_xref_chain(self.xref_offset)
+            if 'Root' not in self.trailer:
+                raise PDFSyntaxError('trailer has no /Root')
+        except Exception:
+            self._rebuild_xref()
+
+    def _read_xref_chain(self, offset):
+        visited = set()
+        while offset is not None and offset not in visited:
+            visited.add(offset)
+            pos = _skip_whitespace(self.data, offset)
+            if self.data[pos:pos + 4] == b'xref':
+                trailer = self._read_xref_table(pos + 4)
+                # 混合型文件：传统表之外还有 xref 流
+                if isinstance(trailer.get('XRefStm'), int):
+                    self._read_xref_stream(trailer['XRefStm'])
+            else:
+                trailer = self._read_xref_stream(pos)
+            for key, value in trailer.items():
+                self.trailer.setdefault(key, value)
+            prev = trailer.get('Prev')
+            offset = prev if isinstance(prev, int) else None
+
+    def _read_xref_table(self, pos):
+        while True:
+            pos = _skip_whitespace(self.data, pos)
+            if self.data[pos:pos + 7] == b'trailer':
+                trailer, _ = parse_object(self.data, pos + 7)
+                return trailer
+            start, pos = parse_object(self.data, pos)
+            count, pos = parse_object(self.data, pos)
+            if not isinstance(start, int) or not isinstance(count, int):
+                raise PDFSyntaxError('bad xref subsection')
+            for i in range(count):
+                pos = _skip_whitespace(self.data, pos)
+                entry = _XREF_ENTRY.match(self.data, pos)
+                if not entry:
+                    raise PDFSyntaxError('bad xref entry')
+                pos = entry.end()
+                if entry.group(3) == b'n':
+                    self.xref.setdefault(start + i, ('offset', int(entry.group(1))))
+
+    def _read_xref_stream(self, pos):
+        header = _OBJ_HEADER.match(self.data, _skip_whitespace(self.data, pos))
+        if not header:
+            raise PDFSyntaxError('xref stream not found')
+        stream = self._parse_indirect(header.end())
+        if not isinstance(stream, Stream) or stream.attrs.get('Type') != 'XRef':
+            raise PDFSyntaxError('not an xref stream')
+
+        attrs = stream.attrs
+        widths = attrs['W']
+        index = attrs.get('Index') or [0, attrs['Size']]
+        data = self.decode_stream(stream)
+        entry_size = sum(widths)
+        pos = 0
+        for section in range(0, len(index) - 1, 2):
+            start, count = index[section], index[section + 1]
+            for i in range(count):
+                if pos + entry_size > len(data):
+                    break
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[pos:pos + width], 'big') if width else None)
+                    pos += width
+                kind = 1 if fields[0] is None else fields[0]
+                if kind == 1:
+                    self.xref.setdefault(start + i, ('offset', fields[1]))
+                elif kind == 2:
+                    self.xref.setdefault(start + i, ('stream', fields[1], fields[2] or 0))
+        return attrs
+
+    def _rebuild_xref(self):
+        """交叉引用损坏时，扫描整个文件中的对象头重建（后出现的覆盖先出现的）"""
+        self.xref = {}
+        self.trailer = {}
+        self._cache = {}
+        special = []
+        for match in _OBJ_SCAN.finditer(self.data):
+            self.xref[int(match.group(1))] = ('offset', match.start())
+            head = self.data[match.end():match.end() + 256]
+            if b'/ObjStm' in head or b'/XRef' in head:
+                special.append(int(match.group(1)))
+
+        pos = self.data.rfind(b'trailer')
+        if pos >= 0:
+            try:
+                self.trailer, _ = parse_object(self.data, pos + 7)
+            except (PDFSyntaxError, IndexError):
+                self.trailer = {}
+
+        # 对象流里的对象扫描不到对象头，需要逐个展开登记；xref 流字典里有 /Root
+        for num in special:
+            try:
+                stream = self.get(Ref(num, 0))
+                if not isinstance(stream, Stream):
+                    continue
+                if stream.attrs.get('Type') == 'XRef':
+                    for key, value in stream.attrs.items():
+                        self.trailer.setdefault(key, value)
+                elif stream.attrs.get('Type') == 'ObjStm':
+                    for obj_num in self._load_object_stream(num)[1]:
+                        self.xref.setdefault(obj_num, ('stream', num, 0))
+            except Exception:
+                continue
+        if 'Root' not in self.trailer:
+            for num in list(self.xref):
+                obj = self.get(Ref(num, 0))
+                if isinstance(obj, dict) and obj.get('Type') == 'Catalog':
+                    self.trailer['Root'] = Ref(num, 0)
+                    break
+
+    # ---------- 对象读取 ----------
+
+    def _parse_indirect(self, pos):
+        obj, pos = parse_object(self.data, pos)
+        pos = _skip_whitespace(self.data, pos)
+        if isinstance(obj, dict) and self.data[pos:pos + 6] == b'stream':
+            pos += 6
+            if self.data[pos:pos + 2] == b'\r\n':
+                pos += 2
+            elif self.data[pos:pos + 1] in (b'\n', b'\r'):
+                pos += 1
+            length = self.resolve(obj.get('Length'))
+            if isinstance(length, int) and self.data[pos + length:pos + length + 20].lstrip().startswith(b'endstream'):
+                end = pos + length
+            else:
+                end = self.data.find(b'endstream', pos)
+                if end < 0:
+                    raise PDFSyntaxError('endstream not found')
+            return Stream(obj, self.data[pos:end])
+        return obj
+
+    def get(self, ref):
+        if ref.num in self._cache:
+            return self._cache[ref.num]
+        entry = self.xref.get(ref.num)
+        obj = None
+        if entry is None:
+            pass
+        elif entry[0] == 'offset':
+            header = _OBJ_HEADER.match(self.data, _skip_whitespace(self.data, entry[1]))
+            if header and int(header.group(1)) == ref.num:
+                obj = self._parse_indirect(header.end())
+        else:
+            obj = self._get_from_object_stream(entry[1], entry[2], ref.num)
+        self._cache[ref.num] = obj
+        return obj
+
+    def _load_object_stream(self, stream_num):
+        if stream_num not in self._objstm_cache:
+            stream = self.get(Ref(stream_num, 0))
+            if not isinstance(stream, Stream):
+                raise PDFSyntaxError('object stream not found')
+            data = self.decode_stream(stream)
+            count = stream.attrs.get('N', 0)
+            first = stream.attrs.get('First', 0)
+            offsets = {}
+            pos = 0
+            for _ in range(count):
+                obj_num, pos = parse_object(data, pos)
+                offset, pos = parse_object(data, pos)
+                offsets[obj_num] = first + offset
+            self._objstm_cache[stream_num] = (data, offsets)
+        return self._objstm_cache[stream_num]
+
+    def _get_from_object_stream(self, stream_num, index, num):
+        data, offsets = self._load_object_stream(stream_num)
+        if num not in offsets:
+            return None
+        obj, _ = parse_object(data, offsets[num])
+        return obj
+
+    def resolve(self, obj, depth=0):
+        while isinstance(obj, Ref) and depth < 32:
+            obj = self.get(obj)
+            depth += 1
+        return obj
+
+    def decode_stream(self, stream):
+        filters = self.resolve(stream.attrs.get('Filter'))
+        params = self.resolve(stream.attrs.get('DecodeParms'))
+        if not isinstance(filters, list):
+            filters = [filters] if filters else []
+        if not isinstance(params, list):
+            params = [params] * len(filters)
+
+        data = bytes(stream.raw)
+        for name, param in zip(filters, params):
+            if name not in ('FlateDecode', 'Fl'):
+                raise PDFSyntaxError(f'unsupported filter {name}')
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(data, MAX_STREAM_BYTES)
+            if decompressor.unconsumed_tail:
+                raise PDFSyntaxError('stream too large')
+            param = self.resolve(param) or {}
+            if param.get('Predictor', 1) >= 10:
+                data = _png_unpredict(data, param.get('Columns', 1), param.get('Colors', 1),
+                                      param.get('BitsPerComponent', 8))
+        return data
+
+    # ---------- 文档结构 ----------
+
+    @property
+    def catalog(self):
+        catalog = self.resolve(self.trailer.get('Root'))
+        return catalog if isinstance(catalog, dict) else {}
+
+    def page_count(self):
+        pages = self.resolve(self.catalog.get('Pages'))
+        if isinstance(pages, dict) and isinstance(self.resolve(pages.get('Count')), int):
+            return self.resolve(pages.get('Count'))
+        return None
+
+    def iter_pages(self):
+        """按顺序遍历页面，产出 (页面引用, 页面字典, 继承后的 Resources)"""
+        root = self.catalog.get('Pages')
+        stack = [(root, None)]
+        visited = set()
+        produced = 0
+        while stack and produced < MAX_PAGES:
+            ref, inherited = stack.pop()
+            if isinstance(ref, Ref):
+                if ref.num in visited:
+                    continue
+                visited.add(ref.num)
+            node = self.resolve(ref)
+            if not isinstance(node, dict):
+                continue
+            resources = self.resolve(node.get('Resources', inherited))
+            kids = self.resolve(node.get('Kids'))
+            if node.get('Type') == 'Pages' or (node.get('Type') != 'Page' and isinstance(kids, list)):
+                for kid in reversed(kids or []):
+                    stack.append((kid, resources))
+            else:
+                produced += 1
+                yield ref, node, resources
+
+    def has_text_layer(self):
+        """抽查前几页是否引用了字体：扫描版 PDF 只有图片，没有字体资源"""
+        for n, (_, _, resources) in enumerate(self.iter_pages()):
+            if n >= TEXT_LAYER_SAMPLE_PAGES:
+                break
+            if isinstance(resources, dict) and self.resolve(resources.get('Font')):
+                return True
+        return False
+
+    def _named_destinations(self):
+        names = {}
+        dests = self.resolve(self.catalog.get('Dests'))
+        if isinstance(dests, dict):
+            for key, value in dests.items():
+                names[str(key)] = value
+
+        name_tree = self.resolve(self.catalog.get('Names'))
+        root = self.resolve(name_tree.get('Dests')) if isinstance(name_tree, dict) else None
+        stack = [root] if isinstance(root, dict) else []
+        visited = 0
+        while stack and visited < MAX_PAGES:
+            node = stack.pop()
+            visited += 1
+            pairs = self.resolve(node.get('Names')) or []
+            for i in range(0, len(pairs) - 1, 2):
+                key = pairs[i]
+                names[key.decode('latin-1') if isinstance(key, bytes) else str(key)] = pairs[i + 1]
+            for kid in self.resolve(node.get('Kids')) or []:
+                kid = self.resolve(kid)
+                if isinstance(kid, dict):
+                    stack.append(kid)
+        return names
+
+    def outline(self):
+        """读取书签目录，返回 [{'title', 'page', 'children'}]，page 从 1 开始"""
+        outlines = self.resolve(self.catalog.get('Outlines'))
+        if not isinstance(outlines, dict) or 'First' not in outlines:
+            return []
+
+        page_numbers = {ref.num: n + 1 for n, (ref, _, _) in enumerate(self.iter_pages())
+                        if isinstance(ref, Ref)}
+        named = None
+        count = 0
+        visited = set()
+
+        def destination_page(item):
+            nonlocal named
+            dest = self.resolve(item.get('Dest'))
+            if dest is None:
+                action = self.resolve(item.get('A'))
+                if isinstance(action, dict) and action.get('S') == 'GoTo':
+                    dest = self.resolve(action.get('D'))
+            if isinstance(dest, (bytes, Name)):
+                if named is None:
+                    named = self._named_destinations()
+                key = dest.decode('latin-1') if isinstance(dest, bytes) else str(dest)
+                dest = self.resolve(named.get(key))
+            if isinstance(dest, dict):
+                dest = self.resolve(dest.get('D'))
+            if isinstance(dest, list) and dest:
+                target = dest[0]
+                if isinstance(target, Ref):
+                    return page_numbers.get(target.num)
+                if isinstance(target, int):
+                    return target + 1
+            return None
+
+        def walk(first_ref, depth):
+            nonlocal count
+            items = []
+            ref = first_ref
+            while isinstance(ref, Ref) and ref.num not in visited and count < MAX_OUTLINE_ITEMS:
+                visited.add(ref.num)
+                item = self.resolve(ref)
+                if not isinstance(item, dict):
+                    break
+                count += 1
+                entry = {
+                    'title': decode_text(self.resolve(item.get('Title'))),
+                    'page': destination_page(item),
+                    'children': []
+                }
+                if depth < MAX_OUTLINE_DEPTH and 'First' in item:
+                    entry['children'] = walk(item['First'], depth + 1)
+                items.append(entry)
+                ref = item.get('Next')
+            return items
+
+        return walk(outlines['First'], 1)
+
+
+def decode_text(value):
+    """解码 PDF 文本字符串：带 BOM 的 UTF-16/UTF-8，否则按 PDFDocEncoding（近似 Latin-1）"""
+    if not isinstance(value, bytes):
+        return str(value or '')
+    if value.startswith(b'\xfe\xff'):
+        text = value[2:].decode('utf-16-be', errors='replace')
+    elif value.startswith(b'\xef\xbb\xbf'):
+        text = value[3:].decode('utf-8', errors='replace')
+    else:
+        text = value.decode('latin-1')
+    return text.replace('\x00', '').strip()
+
+
+def scan_pdf(file_path):
+    """扫描 PDF 结构，返回页数、书签、文字层、文件大小、xref 偏移和线性化信息
+
+    单项解析失败时对应字段为 None，不影响其他字段。
+    """
+    result = {
+        'file_size': None,
+        'page_count': None,
+        'outline': None,
+        'has_text_layer': None,
+        'xref_offset': None,
+        'is_linearized': None,
+    }
+    with open(file_path, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        result['file_size'] = size
+        if size == 0:
+            return result
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        result['is_linearized'] = is_linearized(file_path, size)
+        try:
+            scanner = PDFScanner(data)
+        except Exception:
+            return result
+        result['xref_offset'] = scanner.xref_offset
+        encrypted = 'Encrypt' in scanner.trailer
+
+        for key, method in (('page_count', scanner.page_count),
+                            ('has_text_layer', scanner.has_text_layer),
+                            ('outline', scanner.outline)):
+            # 加密文件的字符串和流都被加密，只保留页数
+            if encrypted and key != 'page_count':
+                continue
+            try:
+                result[key] = method()
+            except Exception:
+                pass
+        return result
+    finally:
+        data.close()
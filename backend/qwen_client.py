@@ -0,0 +1,191 @@
+"""调用通义千问（DashScope 兼容模式）的 HTTP 客户端
+
+所有请求共用一个 requests.Session，连接池里的连接保持长连接复用，不必每次重新握手 TCP/TLS。
+请求都带连接超时和读取超时（流式回复时是两段数据之间的最长间隔），上游卡住不会一直占着线程。
+
+连接失败和 429/5xx 响应按带随机抖动的指数退避重试几次（429 优先按 Retry-After 等待）。
+连续失败达到 BREAKER_THRESHOLD 次后熔断：BREAKER_RESET_SECONDS 内的请求直接抛出
+CircuitOpenError，不再等超时；之后放行一个试探请求，成功则恢复。
+"""
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+QWEN_API_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+
+# 连接池大小，应不小于同时处理对话请求的线程数
+POOL_SIZE = 10
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+# 失败后最多再重试几次；第 n 次重试前等待 0 到 RETRY_BASE_SECONDS * 2**(n-1) 秒之间的随机时长
+MAX_RETRIES = 2
+RETRY_BASE_SECONDS = 0.5
+MAX_RETRY_WAIT = 10
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 连续失败多少次后熔断，熔断多久后放行试探请求
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+
+
+class CircuitOpenError(Exception):
+    """上游连续失败，熔断期间不再发出请求"""
+
+
+class QwenAPIError(Exception):
+    """上游返回错误状态或无法解析的回复"""
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """熔断期间抛出 CircuitOpenError；熔断到期后只放行一个试探请求，返回是否为试探请求"""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            remaining = self._opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0 or self._probing:
+                raise CircuitOpenError(f'上游服务暂不可用，{max(1, round(remaining))} 秒后重试')
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """试探请求没有得到上游的结果就结束了（如请求本身无效），让下一个请求重新试探"""
+        with self._lock:
+            self._probing = False
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+
+breaker = CircuitBreaker()
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                s.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE))
+                s.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE))
+                _session = s
+    return _session
+
+
+def _retry_wait(attempt, response=None):
+    if response is not None and response.status_code == 429:
+        try:
+            return min(float(response.headers['Retry-After']), MAX_RETRY_WAIT)
+        except (KeyError, ValueError):
+            pass
+    return random.uniform(0, min(RETRY_BASE_SECONDS * 2 ** attempt, MAX_RETRY_WAIT))
+
+
+def post_chat(api_key, payload, stream=False, url=None):
+    """POST 一次对话补全请求，返回最后一次的 requests.Response（状态码由调用方检查）
+
+    stream 为 True 时响应体未读取，调用方读完后应 close()。
+    熔断期间抛出 CircuitOpenError，重试后仍连接失败或超时时抛出 requests 的异常。
+    """
+    probe = breaker.before_request()
+    try:
+        return _post_with_retries(api_key, payload, stream, url)
+    except BaseException:
+        # 其他异常（请求头无效、重定向过多等）不算上游故障，但试探请求必须释放，否则熔断一直不会恢复
+        if probe:
+            breaker.release_probe()
+        raise
+
+
+def _post_with_retries(api_key, payload, stream, url):
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+    attempt = 0
+    while True:
+        try:
+            response = session().post(url or QWEN_API_URL, headers=headers, json=payload,
+                                      stream=stream, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # 读取超时时上游可能已经在生成，重试只会叠加等待，直接失败
+            if attempt >= MAX_RETRIES or isinstance(e, requests.ReadTimeout):
+                breaker.record_failure()
+                raise
+            time.sleep(_retry_wait(attempt))
+            attempt += 1
+            continue
+
+        if response.status_code not in RETRY_STATUS:
+            # 4xx（如 API Key 错误）是请求本身的问题，不算上游故障
+            breaker.record_success()
+            return response
+        if attempt >= MAX_RETRIES:
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            return response
+        wait = _retry_wait(attempt, response)
+        response.close()
+        time.sleep(wait)
+        attempt += 1
+
+
+def chat(api_key, payload):
+    """非流式调用，返回回复文本；上游返回错误时抛出 QwenAPIError"""
+    response = post_chat(api_key, payload)
+    if response.status_code != 200:
+        raise QwenAPIError(f'API调用失败：{response.status_code}，{response.text}')
+    result = response.json()
+    if not result.get('choices'):
+        raise QwenAPIError('API返回格式异常')
+    return result['choices'][0]['message']['content']
+
+
+def stream_deltas(response):
+    """逐段产出流式回复（SSE）中的文本，遇到 [DONE] 结束
+
+    连接在 [DONE] 之前关闭（上游中断、代理断开）时抛出 QwenAPIError，调用方不会把不完整的回复当作完整的。
+    """
+    # chunk_size=None：收到多少处理多少，不等凑满缓冲区
+    for line in response.iter_lines(chunk_size=None):
+        line = line.decode('utf-8')
+        if not line.startswith('data:'):
+            continue
+        chunk = line[5:].strip()
+        if chunk == '[DONE]':
+            return
+        choices = json.loads(chunk).get('choices') or []
+        delta = (choices[0].get('delta') or {}).get('content') if choices else None
+        if delta:
+            yield delta
+    raise QwenAPIError('上游在回复结束前断开了连接')
@@ -0,0 +1,166 @@
+"""AI 回复缓存
+
+以 (API Key 的哈希, model, messages, temperature) 的哈希为键缓存模型的完整回复，不同
+API Key（不同账号、不同权限）之间不共用回复。按 TTL 过期、按条数做 LRU 淘汰，命中时只查内存中的字典。指定 db_path 时同时写入一个单独的 SQLite 文件，
+进程重启后内存未命中会再查这里。同一个键的并发请求只调用一次上游，其余请求等待它的结果
+（计为命中，同时计入 coalesced）。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# 等待其他请求完成同一调用的最长时间（秒），与上游读取超时相当
+COALESCE_TIMEOUT = 120
+
+
+def make_key(api_key, payload):
+    data = {k: payload.get(k) for k in ('model', 'messages', 'temperature')}
+    # 只保存 API Key 的哈希，缓存键和缓存文件中都不出现明文
+    data['api_key'] = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()
+    return hashlib.sha256(
+        json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    ).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries, ttl_seconds, db_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries = OrderedDict()   # 键 -> (写入时间, 回复)，按最近使用排序
+        self._lock = threading.Lock()
+        self._inflight = {}             # 键 -> Future
+        self._db = None
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _connect(self):
+        if self._db is None:
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute('CREATE TABLE IF NOT EXISTS response_cache '
+                       '(key TEXT PRIMARY KEY, created_at REAL NOT NULL, response TEXT NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_created_at ON response_cache (created_at)')
+            self._db = db
+        return self._db
+
+    def _load(self, key, now):
+        if not self.db_path:
+            return None
+        with self._db_lock:
+            row = self._connect().execute(
+                'SELECT created_at, response FROM response_cache WHERE key = ? AND created_at > ?',
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def _store(self, key, created_at, response):
+        if not self.db_path:
+            return
+        with self._db_lock:
+            db = self._connect()
+            db.execute('INSERT OR REPLACE INTO response_cache (key, created_at, response) VALUES (?, ?, ?)',
+                       (key, created_at, response))
+            # 删除过期的，只保留最新的 max_entries 条
+            db.execute('DELETE FROM response_cache WHERE created_at <= ? OR key IN '
+                       '(SELECT key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                       (created_at - self.ttl_seconds, self.max_entries))
+            db.commit()
+
+    def get(self, key):
+        """返回未过期的缓存回复，没有时返回 None（计入命中/未命中）"""
+        response = self._lookup(key)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def _lookup(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now - self.ttl_seconds:
+                self._entries.move_to_end(key)
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+        entry = self._load(key, now)
+        if entry is None:
+            return None
+        with self._lock:
+            self._remember(key, entry)
+        return entry[1]
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key, response):
+        entry = (time.time(), response)
+        with self._lock:
+            self._remember(key, entry)
+        self._store(key, *entry)
+
+    def get_or_call(self, key, fn):
+        """返回缓存的回复，没有时调用 fn() 取得并缓存；返回 (回复, 是否来自缓存或其他请求)
+
+        同一个键正在调用时等待那次调用的结果（失败时同样抛出它的异常）。
+        只有真正调用 fn() 的请求计为未命中，等到其他请求结果的计为命中。
+        """
+        response = self._lookup(key)
+        if response is not None:
+            with self._lock:
+                self.hits += 1
+            return response, True
+
+        with self._lock:
+            # 查缓存之后、登记之前，同一个键的调用可能刚好完成
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time() - self.ttl_seconds:
+                self.hits += 1
+                return entry[1], True
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+
+        if not owner:
+            response = future.result(timeout=COALESCE_TIMEOUT)
+            with self._lock:
+                self.hits += 1
+                self.coalesced += 1
+            return response, True
+
+        try:
+            response = fn()
+            self.put(key, response)
+            future.set_result(response)
+            return response, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
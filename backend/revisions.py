@@ -0,0 +1,205 @@
+"""备忘录的历史版本
+
+保存备忘录时把被覆盖的内容记为一个历史版本。为节省空间，历史版本保存的是反向差异：
+由更新一个的历史版本（最新的历史版本则由备忘录当前内容）还原出本版本，差异按行计算后
+用 zlib 压缩。每隔 KEYFRAME_INTERVAL 个版本保存一个完整内容的关键帧，还原任意版本最多
+只需应用 KEYFRAME_INTERVAL - 1 个差异。
+
+连续编辑（自动保存）时，COALESCE_SECONDS 内的多次保存合并为一个历史版本。
+thin() 按保留策略清理旧版本：越旧的版本保留得越稀疏。
+
+每个历史版本在 blob_ref 中登记它的内容引用的图片（owner_type 为 'revision'），
+删除版本时释放，备忘录中删掉的图片在历史版本还在时不会被回收，恢复版本后仍能显示。
+"""
+import json
+import zlib
+from datetime import datetime, timedelta
+from difflib import SequenceMatcher
+
+from sqlalchemy import update
+
+from . import storage
+from .models import db, Note, NoteRevision
+
+# 每隔多少个历史版本保存一个关键帧
+KEYFRAME_INTERVAL = 50
+# 距上一个历史版本不到这么久的保存不新建版本
+COALESCE_SECONDS = 5 * 60
+# 保留策略：(版本年龄上限, 时间段长度)，每个时间段只保留最新的一个版本；
+# 一天内的版本全部保留，更旧的超过最后一档按每 30 天保留一个
+RETENTION = [
+    (timedelta(days=1), None),
+    (timedelta(days=7), timedelta(hours=1)),
+    (timedelta(days=90), timedelta(days=1)),
+]
+OLDEST_BUCKET = timedelta(days=30)
+# 每个备忘录最多保留的历史版本数
+MAX_REVISIONS = 200
+
+
+def _lines(text):
+    return (text or '').splitlines(keepends=True)
+
+
+def encode_delta(base, target):
+    """计算由 base 还原 target 的差异：复制 base 的行区间 [i, j) 或插入文本"""
+    base_lines, target_lines = _lines(base), _lines(target)
+    ops = []
+    matcher = SequenceMatcher(None, base_lines, target_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(target_lines[j1:j2]))
+    return zlib.compress(json.dumps(ops, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def apply_delta(base, data):
+    base_lines = _lines(base)
+    ops = json.loads(zlib.decompress(data).decode('utf-8'))
+    return ''.join(''.join(base_lines[op[0]:op[1]]) if isinstance(op, list) else op for op in ops)
+
+
+def encode_keyframe(content):
+    return zlib.compress((content or '').encode('utf-8'))
+
+
+def _decode(revision, newer_content):
+    if revision.keyframe:
+        return zlib.decompress(revision.data).decode('utf-8')
+    return apply_delta(newer_content, revision.data)
+
+
+def _encode(revision, content, newer_content, keyframe):
+    revision.keyframe = keyframe
+    revision.data = encode_keyframe(content) if keyframe else encode_delta(newer_content, content)
+    revision.content_length = len(content)
+
+
+def record(note, old_title, old_content, new_content, now=None):
+    """备忘录从 (old_title, old_content) 保存为 new_content 后调用，记录被覆盖的版本
+
+    note 的 version 应为保存前的版本号；调用方保证这次保存和记录在同一个事务中。
+    """
+    now = now or datetime.utcnow()
+    revisions = NoteRevision.query.filter_by(note_id=note.id) \
+        .order_by(NoteRevision.version.desc()).limit(KEYFRAME_INTERVAL).all()
+    latest = revisions[0] if revisions else None
+
+    if latest is not None and latest.created_at > now - timedelta(seconds=COALESCE_SECONDS):
+        # 合并到最近的历史版本；它的差异原本相对 old_content，改为相对新内容
+        if not latest.keyframe and old_content != new_content:
+            content = apply_delta(old_content, latest.data)
+            latest.data = encode_delta(new_content, content)
+        return latest
+
+    # 距离最近的关键帧（或当前内容）已有 KEYFRAME_INTERVAL - 1 个差异时保存关键帧
+    deltas = 0
+    for revision in revisions:
+        if revision.keyframe:
+            break
+        deltas += 1
+    revision = NoteRevision(note_id=note.id, version=note.version, title=old_title, created_at=now)
+    _encode(revision, old_content, new_content, deltas >= KEYFRAME_INTERVAL - 1)
+    db.session.add(revision)
+    db.session.flush()
+    storage.add_refs('revision', revision.id, storage.keys_in_text(old_content))
+    return revision
+
+
+def content_of(revision, current_content):
+    """还原历史版本的内容：从它之上最近的关键帧（或当前内容）开始逐个应用差异"""
+    chain = [revision.id]
+    if not revision.keyframe:
+        # 先只查编号和关键帧标记，确定需要的差异后再加载数据
+        newer = db.session.query(NoteRevision.id, NoteRevision.keyframe).filter(
+            NoteRevision.note_id == revision.note_id, NoteRevision.version > revision.version
+        ).order_by(NoteRevision.version).all()
+        for revision_id, keyframe in newer:
+            chain.append(revision_id)
+            if keyframe:
+                break
+
+    loaded = {r.id: r for r in NoteRevision.query.filter(NoteRevision.id.in_(chain))}
+    content = current_content
+    for revision_id in reversed(chain):
+        content = _decode(loaded[revision_id], content)
+    return content
+
+
+def remove(note_id):
+    for (revision_id,) in db.session.query(NoteRevision.id).filter_by(note_id=note_id).all():
+        storage.remove_refs('revision', revision_id)
+    NoteRevision.query.filter_by(note_id=note_id).delete()
+
+
+def _keep(revisions, now):
+    """按保留策略选出要保留的历史版本（revisions 按版本从新到旧排列）"""
+    keep = set()
+    seen_buckets = set()
+    for revision in revisions:
+        age = now - revision.created_at
+        bucket = None
+        for limit, size in RETENTION:
+            if age < limit:
+                bucket = (limit, age // size) if size else ('all', revision.id)
+                break
+        else:
+            bucket = ('old', age // OLDEST_BUCKET)
+        # 从新到旧遍历，每个时间段遇到的第一个就是最新的
+        if bucket not in seen_buckets:
+            seen_buckets.add(bucket)
+            keep.add(revision.id)
+        if len(keep) >= MAX_REVISIONS:
+            break
+    return keep
+
+
+def thin(note, now=None):
+    """按保留策略删除备忘录的旧版本，并重新计算保留版本的差异和关键帧，返回删除个数"""
+    now = now or datetime.utcnow()
+    # 先写一次备忘录（不改变任何值）拿到写锁，重新编码期间备忘录不会被保存
+    db.session.execute(update(Note).where(Note.id == note.id).values(updated_at=Note.updated_at)
+                       .execution_options(synchronize_session=False))
+    db.session.refresh(note)
+    revisions = NoteRevision.query.filter_by(note_id=note.id) \
+        .order_by(NoteRevision.version.desc()).all()
+    keep = _keep(revisions, now)
+    if len(keep) == len(revisions):
+        return 0
+
+    # 从新到旧依次还原全部内容，再按保留后的相邻关系重新编码
+    contents = {}
+    newer_content = note.content or ''
+    for revision in revisions:
+        newer_content = contents[revision.id] = _decode(revision, newer_content)
+
+    removed = 0
+    newer_content = note.content or ''
+    deltas = 0
+    for revision in revisions:
+        if revision.id not in keep:
+            storage.remove_refs('revision', revision.id)
+            db.session.delete(revision)
+            removed += 1
+            continue
+        content = contents[revision.id]
+        keyframe = deltas >= KEYFRAME_INTERVAL - 1
+        _encode(revision, content, newer_content, keyframe)
+        deltas = 0 if keyframe else deltas + 1
+        newer_content = content
+    return removed
+
+
+def thin_all(now=None):
+    """清理所有备忘录的旧版本，返回删除个数"""
+    removed = 0
+    note_ids = [row[0] for row in db.session.query(NoteRevision.note_id).distinct()]
+    for note_id in note_ids:
+        note = db.session.get(Note, note_id)
+        if note is None:
+            remove(note_id)
+        else:
+            removed += thin(note, now)
+        db.session.commit()
+    return removed
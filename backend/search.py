@@ -0,0 +1,289 @@
+"""基于 SQLite FTS5 的全文检索
+
+书籍按页（与 TXT 分页索引一致）切块写入 book_fts，每块记录所在页和字节偏移，
+搜索结果可以直接让阅读器跳到命中位置。使用 trigram 分词器，中文无需额外分词。
+rowid 编码为 book_id << PAGE_BITS | page，按书删除和过滤都走 rowid 范围查询。
+
+trigram 只能检索 3 个字符以上的词，而中文人名、地名多是两个字，所以每页相邻两个字
+（字母、数字）组成的二元组另外写入 book_bigram_fts（无内容表，只存倒排索引），
+两个字的词在这里查；只有单个字的词才退回 LIKE 扫描。
+
+备忘录的标题和去掉标记后的正文写入 note_fts，保存备忘录时同步更新。
+"""
+import hashlib
+import html
+import re
+
+from sqlalchemy import DDL, event, text
+
+from .models import db
+
+# 高亮标记先用私有区字符占位，转义 HTML 后再替换成 <mark>
+_MARK_OPEN = '\ue000'
+_MARK_CLOSE = '\ue001'
+# trigram 分词器要求检索词至少 3 个字符，两个字符的词查二元组索引，更短的词退回 LIKE 扫描
+MIN_MATCH_CHARS = 3
+BIGRAM_CHARS = 2
+SNIPPET_TOKENS = 24
+SNIPPET_CONTEXT_CHARS = 30
+MAX_RESULTS = 100
+PAGE_BITS = 20
+
+
+# FTS5 虚拟表不在模型元数据里，挂在 create_all 之后一并创建
+event.listen(db.metadata, 'after_create', DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS book_fts USING fts5("
+    "content, start_offset UNINDEXED, tokenize='trigram')"
+))
+# 无内容表：删除时要用 'delete' 命令提供原来写入的二元组（由 book_fts 的内容重新计算）
+event.listen(db.metadata, 'after_create', DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS book_bigram_fts USING fts5("
+    "content, content='', detail=none)"
+))
+event.listen(db.metadata, 'after_create', DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5("
+    "note_id UNINDEXED, title, content, tokenize='trigram')"
+))
+# 排序时标题命中的权重（按列顺序：note_id, title, content）
+NOTE_RANK = 'bm25(note_fts, 0.0, 5.0, 1.0)'
+
+
+def _rowid_range(book_id):
+    return {'low': book_id << PAGE_BITS, 'high': ((book_id + 1) << PAGE_BITS) - 1}
+
+
+def bigrams(content):
+    """相邻两个字母或数字组成的二元组，以空格分隔，由 unicode61 分词器逐个建索引"""
+    return ' '.join(content[i:i + 2] for i in range(len(content) - 1)
+                    if content[i].isalnum() and content[i + 1].isalnum())
+
+
+def _insert_bigrams(rows):
+    if rows:
+        db.session.execute(text("INSERT INTO book_bigram_fts (rowid, content) VALUES (:rowid, :content)"),
+                           [{'rowid': rowid, 'content': bigrams(content)} for rowid, content in rows])
+
+
+def remove_book(book_id):
+    params = _rowid_range(book_id)
+    rows = db.session.execute(text("SELECT rowid, content FROM book_fts WHERE rowid BETWEEN :low AND :high"),
+                              params).all()
+    if rows:
+        db.session.execute(text(
+            "INSERT INTO book_bigram_fts (book_bigram_fts, rowid, content) VALUES ('delete', :rowid, :content)"
+        ), [{'rowid': rowid, 'content': bigrams(content)} for rowid, content in rows])
+    db.session.execute(text("DELETE FROM book_fts WHERE rowid BETWEEN :low AND :high"), params)
+
+
+def index_book(book_id, file_path, offsets):
+    """按页把书籍内容写入全文索引，offsets 为分页索引中的页起始偏移"""
+    remove_book(book_id)
+
+    rows = []
+    with open(file_path, 'rb') as f:
+        for n in range(len(offsets) - 1):
+            chunk = f.read(offsets[n + 1] - offsets[n]).decode('utf-8', errors='replace')
+            if chunk.strip():
+                rows.append({'rowid': (book_id << PAGE_BITS) | (n + 1), 'content': chunk,
+                             'start_offset': offsets[n]})
+
+    if rows:
+        db.session.execute(text(
+            "INSERT INTO book_fts (rowid, content, start_offset) "
+            "VALUES (:rowid, :content, :start_offset)"
+        ), rows)
+        _insert_bigrams([(row['rowid'], row['content']) for row in rows])
+
+
+def copy_book(source_id, book_id):
+    """复制另一本书（内容相同）的索引，只需改写 rowid 中的书籍编号"""
+    remove_book(book_id)
+    params = _rowid_range(source_id)
+    params['delta'] = (book_id - source_id) << PAGE_BITS
+    db.session.execute(text(
+        "INSERT INTO book_fts (rowid, content, start_offset) "
+        "SELECT rowid + :delta, content, start_offset FROM book_fts "
+        "WHERE rowid BETWEEN :low AND :high"
+    ), params)
+    _insert_bigrams(db.session.execute(text(
+        "SELECT rowid, content FROM book_fts WHERE rowid BETWEEN :low AND :high"
+    ), _rowid_range(book_id)).all())
+
+
+def _split_terms(query):
+    return [term for term in query.split() if term]
+
+
+def _match_expression(terms):
+    # 每个词都作为短语加引号，避免用户输入被当作 FTS5 语法解析
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def _is_bigram_term(term):
+    return len(term) == BIGRAM_CHARS and term.isalnum()
+
+
+def _render_snippet(raw):
+    return html.escape(raw).replace(_MARK_OPEN, '<mark>').replace(_MARK_CLOSE, '</mark>')
+
+
+def _terms_pattern(terms):
+    # 与 FTS5 分词器一致，不区分大小写
+    return re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+
+
+def _make_snippet(content, terms):
+    """在 Python 端截取命中词附近的文本作为摘要（二元组和 LIKE 查询时使用）"""
+    pattern = _terms_pattern(terms)
+    match = pattern.search(content)
+    hit = match.start() if match else 0
+    start = max(0, hit - SNIPPET_CONTEXT_CHARS)
+    end = hit + SNIPPET_CONTEXT_CHARS * 2
+    raw = pattern.sub(lambda m: f'{_MARK_OPEN}{m.group(0)}{_MARK_CLOSE}', content[start:end])
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if end < len(content) else ''
+    return prefix + _render_snippet(raw) + suffix
+
+
+def _hit_offset(content, start_offset, terms):
+    """命中词在文件中的字节偏移"""
+    match = _terms_pattern(terms).search(content)
+    if match is None:
+        return start_offset
+    return start_offset + len(content[:match.start()].encode('utf-8'))
+
+
+def search_books(query, book_id=None, limit=20):
+    """检索书籍内容，返回按相关度排序的命中列表"""
+    terms = _split_terms(query)
+    if not terms:
+        return []
+    limit = max(1, min(limit, MAX_RESULTS))
+    params = {'limit': limit}
+    book_filter = ''
+    if book_id is not None:
+        book_filter = ' AND rowid BETWEEN :low AND :high'
+        params.update(_rowid_range(book_id))
+
+    long_terms = [term for term in terms if len(term) >= MIN_MATCH_CHARS]
+    short_terms = [term for term in terms if len(term) < MIN_MATCH_CHARS]
+    if not short_terms:
+        params.update(match=_match_expression(terms), open=_MARK_OPEN, close=_MARK_CLOSE,
+                      tokens=SNIPPET_TOKENS)
+        rows = db.session.execute(text(
+            "SELECT rowid, start_offset, content, "
+            "snippet(book_fts, 0, :open, :close, '…', :tokens) AS snippet "
+            "FROM book_fts WHERE book_fts MATCH :match" + book_filter +
+            " ORDER BY rank LIMIT :limit"
+        ), params).mappings().all()
+        snippets = [_render_snippet(row['snippet']) for row in rows]
+    elif all(_is_bigram_term(term) for term in short_terms):
+        params['bigram_match'] = _match_expression(short_terms)
+        if long_terms:
+            # 长词照常查 trigram 索引，两个字的词用二元组索引过滤
+            params['match'] = _match_expression(long_terms)
+            sql = ("SELECT rowid, start_offset, content FROM book_fts WHERE book_fts MATCH :match"
+                   # +rowid：不让 rowid 条件下推给 FTS5（否则会按每个 rowid 各执行一次 MATCH）
+                   " AND +rowid IN (SELECT rowid FROM book_bigram_fts WHERE book_bigram_fts MATCH :bigram_match)" +
+                   book_filter + " ORDER BY rank LIMIT :limit")
+        else:
+            sql = ("SELECT book_fts.rowid AS rowid, book_fts.start_offset, book_fts.content FROM book_bigram_fts "
+                   "JOIN book_fts ON book_fts.rowid = book_bigram_fts.rowid "
+                   "WHERE book_bigram_fts MATCH :bigram_match" +
+                   (' AND book_bigram_fts.rowid BETWEEN :low AND :high' if book_id is not None else '') +
+                   " ORDER BY book_bigram_fts.rank LIMIT :limit")
+        rows = db.session.execute(text(sql), params).mappings().all()
+        snippets = [_make_snippet(row['content'], terms) for row in rows]
+    else:
+        conditions = []
+        for i, term in enumerate(terms):
+            key = f'term{i}'
+            conditions.append(f"content LIKE :{key} ESCAPE '\\'")
+            params[key] = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        rows = db.session.execute(text(
+            "SELECT rowid, start_offset, content FROM book_fts WHERE " +
+            ' AND '.join(conditions) + book_filter +
+            " ORDER BY rowid LIMIT :limit"
+        ), params).mappings().all()
+        snippets = [_make_snippet(row['content'], terms) for row in rows]
+
+    return [{
+        'book_id': row['rowid'] >> PAGE_BITS,
+        'page': row['rowid'] & ((1 << PAGE_BITS) - 1),
+        'offset': _hit_offset(row['content'], row['start_offset'], terms),
+        'snippet': snippet
+    } for row, snippet in zip(rows, snippets)]
+
+
+def _note_rowid(note_id):
+    """备忘录 id 是字符串，取哈希的前 7 字节作为 note_fts 的 rowid，按 id 更新时走主键"""
+    return int.from_bytes(hashlib.sha256(note_id.encode('utf-8')).digest()[:7], 'big')
+
+
+def remove_note(note_id):
+    db.session.execute(text("DELETE FROM note_fts WHERE rowid = :rowid"), {'rowid': _note_rowid(note_id)})
+
+
+def index_note(note_id, title, plain_text):
+    """写入（或替换）一条备忘录的索引，plain_text 为去掉标记后的正文"""
+    db.session.execute(text(
+        "INSERT OR REPLACE INTO note_fts (rowid, note_id, title, content) "
+        "VALUES (:rowid, :note_id, :title, :content)"
+    ), {'rowid': _note_rowid(note_id), 'note_id': note_id, 'title': title or '', 'content': plain_text or ''})
+
+
+def _highlight_terms(raw, terms):
+    for term in terms:
+        raw = raw.replace(term, f'{_MARK_OPEN}{term}{_MARK_CLOSE}')
+    return _render_snippet(raw)
+
+
+def search_notes(query, limit=20):
+    """检索备忘录标题和正文，返回按相关度排序的命中列表（标题和摘要已高亮）
+
+    摘要在 SQLite 中截取，正文不会读入 Python。
+    """
+    terms = _split_terms(query)
+    if not terms:
+        return []
+    limit = max(1, min(limit, MAX_RESULTS))
+    params = {'limit': limit}
+
+    if all(len(term) >= MIN_MATCH_CHARS for term in terms):
+        params.update(match=_match_expression(terms), open=_MARK_OPEN, close=_MARK_CLOSE,
+                      tokens=SNIPPET_TOKENS)
+        rows = db.session.execute(text(
+            "SELECT note_fts.note_id AS id, "
+            "highlight(note_fts, 1, :open, :close) AS title, "
+            "snippet(note_fts, 2, :open, :close, '…', :tokens) AS snippet "
+            "FROM note_fts JOIN note ON note.id = note_fts.note_id "
+            "WHERE note_fts MATCH :match ORDER BY " + NOTE_RANK + " LIMIT :limit"
+        ), params).mappings().all()
+        return [{'id': row['id'], 'title': _render_snippet(row['title']),
+                 'snippet': _render_snippet(row['snippet'])} for row in rows]
+
+    else:
+        # 短词无法走 trigram 索引：LIKE 扫描，只取第一个词附近的一段正文
+        conditions = []
+        for i, term in enumerate(terms):
+            key = f'term{i}'
+            conditions.append(f"(note_fts.title LIKE :{key} ESCAPE '\\' OR note_fts.content LIKE :{key} ESCAPE '\\')")
+            params[key] = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        width = SNIPPET_CONTEXT_CHARS * 3
+        params.update(first=terms[0], context=SNIPPET_CONTEXT_CHARS, width=width)
+        rows = db.session.execute(text(
+            "SELECT id, title, substr(content, start, :width) AS excerpt, start, length FROM ("
+            "SELECT note_fts.note_id AS id, note_fts.title AS title, note_fts.content AS content, "
+            "max(1, instr(note_fts.content, :first) - :context) AS start, "
+            "length(note_fts.content) AS length, note.updated_at AS updated_at "
+            "FROM note_fts JOIN note ON note.id = note_fts.note_id WHERE " +
+            ' AND '.join(conditions) + " ORDER BY note.updated_at DESC LIMIT :limit"
+            ") ORDER BY updated_at DESC"
+        ), params).mappings().all()
+        results = []
+        for row in rows:
+            prefix = '…' if row['start'] > 1 else ''
+            suffix = '…' if row['start'] - 1 + width < row['length'] else ''
+            results.append({'id': row['id'], 'title': _highlight_terms(row['title'], terms),
+                            'snippet': prefix + _highlight_terms(row['excerpt'] or '', terms) + suffix})
+        return results
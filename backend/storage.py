@@ -0,0 +1,248 @@
+"""内容寻址的上传文件存储
+
+上传内容边写盘边计算 SHA-256，按哈希分两级目录存放（ab/cd/<哈希>.<扩展名>），
+相同内容只保存一份。书籍、游戏的 file_path 直接保存 blob 键；旧数据仍是各自目录下
+的普通文件名。
+
+blob_ref 表记录每个书籍、游戏、备忘录及其历史版本（以及派生出兼容格式的图片）引用了哪些 blob，
+在对应记录写入时增量维护，blob.ref_count 是引用数的冗余计数。引用数归零的 blob
+记下 orphaned_at，垃圾回收只检查这些 blob，过了宽限期仍无人引用才删除文件。
+"""
+import hashlib
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+
+from .models import db, Blob, BlobRef
+
+CHUNK_BYTES = 1024 * 1024
+# blob 键：64 位十六进制哈希 + 扩展名
+BLOB_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]{1,10}$')
+# 文本（备忘录内容）中引用 blob 的 URL
+BLOB_URL_PATTERN = re.compile(r'/uploads/blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64}\.[a-z0-9]{1,10})')
+# 无人引用的 blob 保留这么久再删除（刚上传、还没保存进备忘录的图片不会被误删）
+GC_GRACE = timedelta(days=1)
+GC_BATCH = 200
+
+
+class HashingWriter:
+    """写文件的同时累计 SHA-256 和字节数"""
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self._f.write(data)
+
+
+def is_blob_key(name):
+    return bool(name) and BLOB_KEY_PATTERN.match(name) is not None
+
+
+def normalize_ext(filename, default='bin'):
+    """从上传文件名取扩展名，只保留小写字母和数字"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    ext = ''.join(c for c in ext if c.isascii() and c.isalnum())[:10]
+    return ext or default
+
+
+def blob_relative_path(key):
+    return f'{key[:2]}/{key[2:4]}/{key}'
+
+
+def blob_path(key):
+    return os.path.join(current_app.config['BLOB_FOLDER'], key[:2], key[2:4], key)
+
+
+def blob_url(key):
+    return f'/uploads/blobs/{blob_relative_path(key)}'
+
+
+def resolve(file_path, legacy_folder):
+    """file_path 是 blob 键时返回存储中的路径，否则按旧数据拼在 legacy_folder 下"""
+    if is_blob_key(file_path):
+        return blob_path(file_path)
+    return os.path.join(legacy_folder, file_path)
+
+
+def temp_path(name=None):
+    """存储目录下的临时文件路径（与 blob 同一文件系统，移入时只需改名）"""
+    tmp_dir = os.path.join(current_app.config['BLOB_FOLDER'], 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, name or uuid.uuid4().hex)
+
+
+def keys_in_text(text):
+    """找出文本中引用的所有 blob 键"""
+    return set(BLOB_URL_PATTERN.findall(text or ''))
+
+
+def blob_exists(key):
+    return os.path.exists(blob_path(key)) and db.session.get(Blob, key) is not None
+
+
+def file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def register(key, size=None):
+    """登记 blob（已存在时什么也不做）；还没有引用的 blob 重新开始计算宽限期
+
+    新文件在调用方用 add_refs/set_refs 建立引用之前都算作无人引用。
+    """
+    now = datetime.utcnow()
+    db.session.execute(
+        insert(Blob).values(key=key, size=size, ref_count=0, orphaned_at=now)
+        .on_conflict_do_update(index_elements=['key'], set_={
+            'orphaned_at': case((Blob.ref_count <= 0, now), else_=Blob.orphaned_at)
+        })
+    )
+
+
+def add_file(path, ext, digest=None, size=None):
+    """把已经写好的文件移入存储并登记，返回 blob 键
+
+    内容已存在时直接删除 path，不再重复保存。
+    """
+    if digest is None:
+        digest = file_digest(path)
+    if size is None:
+        size = os.path.getsize(path)
+    key = f'{digest}.{ext}'
+    dest = blob_path(key)
+    if os.path.exists(dest):
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(path, dest)
+    register(key, size)
+    return key
+
+
+def save_stream(stream, ext, transform=None):
+    """把上传流写入存储并登记，返回 blob 键
+
+    transform(stream, writer) 可以在写盘时转换内容（如 TXT 转码），
+    哈希按最终写入的内容计算，整个过程只读一遍上传流。
+    """
+    tmp = temp_path()
+    try:
+        with open(tmp, 'wb') as f:
+            writer = HashingWriter(f)
+            if transform is not None:
+                transform(stream, writer)
+            else:
+                for chunk in iter(lambda: stream.read(CHUNK_BYTES), b''):
+                    writer.write(chunk)
+        return add_file(tmp, ext, writer.sha256.hexdigest(), writer.size)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def add_refs(owner_type, owner_id, keys):
+    """记录 owner 引用了 keys 中的 blob（不存在的 blob 和已有的引用会被跳过）"""
+    owner_id = str(owner_id)
+    keys = {key for key in keys if is_blob_key(key)}
+    if not keys:
+        return
+    known = set(db.session.execute(select(Blob.key).where(Blob.key.in_(keys))).scalars())
+    current = set(db.session.execute(select(BlobRef.blob_key).where(
+        BlobRef.owner_type == owner_type, BlobRef.owner_id == owner_id, BlobRef.blob_key.in_(keys)
+    )).scalars())
+    added = known - current
+    if not added:
+        return
+    db.session.execute(insert(BlobRef), [
+        {'blob_key': key, 'owner_type': owner_type, 'owner_id': owner_id} for key in added
+    ])
+    db.session.execute(update(Blob).where(Blob.key.in_(added))
+                       .values(ref_count=Blob.ref_count + 1, orphaned_at=None))
+
+
+def remove_refs(owner_type, owner_id, keys=None):
+    """删除 owner 对 keys（默认全部）的引用，引用数归零的 blob 开始计算宽限期"""
+    owner_id = str(owner_id)
+    query = select(BlobRef.blob_key).where(BlobRef.owner_type == owner_type, BlobRef.owner_id == owner_id)
+    if keys is not None:
+        query = query.where(BlobRef.blob_key.in_(set(keys)))
+    removed = set(db.session.execute(query).scalars())
+    if not removed:
+        return
+    db.session.execute(delete(BlobRef).where(
+        BlobRef.owner_type == owner_type, BlobRef.owner_id == owner_id, BlobRef.blob_key.in_(removed)
+    ))
+    db.session.execute(update(Blob).where(Blob.key.in_(removed)).values(
+        ref_count=Blob.ref_count - 1,
+        orphaned_at=case((Blob.ref_count <= 1, datetime.utcnow()), else_=Blob.orphaned_at)
+    ))
+
+
+def set_refs(owner_type, owner_id, keys):
+    """把 owner 的引用更新为 keys，只改动有变化的部分"""
+    keys = {key for key in keys if is_blob_key(key)}
+    current = set(db.session.execute(select(BlobRef.blob_key).where(
+        BlobRef.owner_type == owner_type, BlobRef.owner_id == str(owner_id)
+    )).scalars())
+    remove_refs(owner_type, owner_id, current - keys)
+    add_refs(owner_type, owner_id, keys - current)
+
+
+def remove_legacy_file(file_path, legacy_folder):
+    """旧数据（不在 blob 存储里）没有引用记录，随记录一起直接删除"""
+    if is_blob_key(file_path):
+        return
+    path = os.path.join(legacy_folder, file_path)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def collect_garbage(grace=GC_GRACE):
+    """删除无人引用超过宽限期的 blob，返回 (删除个数, 释放字节数)
+
+    只检查 orphaned_at 已过期的 blob，工作量与变化量成正比，不扫描全部记录。
+    """
+    cutoff = datetime.utcnow() - grace
+    removed = freed = 0
+    while True:
+        batch = Blob.query.filter(Blob.ref_count <= 0, Blob.orphaned_at < cutoff) \
+            .order_by(Blob.orphaned_at).limit(GC_BATCH).all()
+        if not batch:
+            break
+        for blob in batch:
+            # 冗余计数与引用表不一致时以引用表为准
+            refs = db.session.execute(select(func.count()).select_from(BlobRef)
+                                      .where(BlobRef.blob_key == blob.key)).scalar()
+            if refs:
+                blob.ref_count = refs
+                blob.orphaned_at = None
+                continue
+            # 带条件删除：宽限期内被重新上传（register 刷新了 orphaned_at）的不删
+            deleted = db.session.execute(delete(Blob).where(
+                Blob.key == blob.key, Blob.ref_count <= 0, Blob.orphaned_at < cutoff
+            )).rowcount
+            if not deleted:
+                continue
+            # 由它派生的文件（兼容格式、原图）失去引用，在下一次回收时删除
+            remove_refs('blob', blob.key)
+            path = blob_path(blob.key)
+            if os.path.exists(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+            removed += 1
+        db.session.commit()
+        db.session.expire_all()
+    return removed, freed
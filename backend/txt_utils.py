@@ -0,0 +1,187 @@
+"""TXT 书籍的转码与分页索引工具
+
+上传时流式地把文本转成 UTF-8 写盘，再扫描一次记录每一页在文件中的字节偏移，
+阅读时只需 seek 到对应位置读取所需的几页，不必下载整本书。
+"""
+import codecs
+import re
+from array import array
+
+from charset_normalizer import from_bytes
+
+# 每页的目标字节数（UTF-8 下约 1000 个汉字，大致一屏）
+PAGE_BYTES = 3000
+# 单次请求最多返回的页数
+MAX_PAGES_PER_REQUEST = 20
+# 编码探测只看文件开头的这么多字节
+SAMPLE_BYTES = 64 * 1024
+# 流式转码每次读取的字节数
+CHUNK_BYTES = 1024 * 1024
+# 用户指定编码失败后依次尝试的备选编码
+FALLBACK_ENCODINGS = ['utf-8', 'gb18030', 'gbk', 'gb2312']
+# 章节标题的最大长度，超过的行视为正文
+MAX_CHAPTER_TITLE = 50
+# 常见网文章节标题：第X章/回/节/卷…，以及序章、楔子、尾声、番外等
+CHAPTER_PATTERN = re.compile(
+    r'^\s*(第\s*[0-9０-９零〇一二两三四五六七八九十百千万]+\s*[章回节卷集部篇]'
+    r'|序章|序言|楔子|引子|前言|尾声|后记|番外)'
+)
+# GB18030 是 GBK/GB2312 的超集，单遍转码时直接用它，避免样本之后出现生僻字时解码出错
+SUPERSET_ENCODINGS = {'gbk': 'gb18030', 'gb2312': 'gb18030'}
+
+
+def _decodes_cleanly(sample, encoding, final):
+    """样本能否用该编码严格解码；样本不是文件全部时允许末尾有半个字符"""
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(sample, final=final)
+        return True
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+
+def detect_encoding(sample, preferred='utf-8', complete=False):
+    """根据文件开头的样本确定编码
+
+    优先使用用户选择的编码，样本解码失败时交给 charset_normalizer 判断，
+    仍无结果再依次尝试常用中文编码，最后退回 UTF-8。
+    complete 表示样本已经是整个文件。
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+
+    preferred = SUPERSET_ENCODINGS.get((preferred or '').lower(), preferred)
+
+    if preferred and _decodes_cleanly(sample, preferred, complete):
+        return preferred
+
+    # 样本可能在多字节字符中间被截断，charset_normalizer 会因此拒绝判断，
+    # 所以依次去掉末尾至多 3 个字节重试
+    for trim in range(1 if complete else 4):
+        best = from_bytes(sample[:len(sample) - trim]).best()
+        if best is not None and _decodes_cleanly(sample, best.encoding, complete):
+            return best.encoding
+
+    for encoding in FALLBACK_ENCODINGS:
+        if _decodes_cleanly(sample, encoding, complete):
+            return encoding
+    return 'utf-8'
+
+
+def transcode_to_utf8(stream, out, preferred='utf-8'):
+    """把上传的文本流按块转码成 UTF-8 写入 out（任何带 write 方法的对象）
+
+    只读取一个有限的前缀样本做编码探测，之后用增量解码器逐块解码，
+    内存占用与文件大小无关，整个文件只解码一遍。返回最终使用的编码。
+    """
+    sample = stream.read(SAMPLE_BYTES)
+    encoding = detect_encoding(sample, preferred, complete=len(sample) < SAMPLE_BYTES)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+    chunk = sample
+    while chunk:
+        out.write(decoder.decode(chunk).encode('utf-8'))
+        chunk = stream.read(CHUNK_BYTES)
+    out.write(decoder.decode(b'', final=True).encode('utf-8'))
+    return encoding
+
+
+def _utf8_boundary(data, pos):
+    """把切分位置向前移到 UTF-8 字符边界，避免把一个汉字切成两半"""
+    while pos > 0 and (data[pos] & 0xC0) == 0x80:
+        pos -= 1
+    return pos
+
+
+def build_page_index(file_path, page_bytes=PAGE_BYTES):
+    """扫描 UTF-8 文本文件，返回 (页起始偏移数组, 每页起始行号数组, 总行数)
+
+    偏移数组比页数多一个元素，最后一个元素是文件总长度，
+    因此第 n 页（从 0 开始）的内容就是 [offsets[n], offsets[n+1])。
+    分页尽量落在行边界上，超长的行按字符边界拆开。
+    """
+    offsets = array('Q', [0])
+    page_lines = array('I', [0])
+    pos = 0
+    page_size = 0
+    line_no = 0
+
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if page_size and page_size + len(line) > page_bytes:
+                offsets.append(pos)
+                page_lines.append(line_no)
+                page_size = 0
+
+            # 单行就超过一页时，在字符边界处拆分
+            start = 0
+            while len(line) - start > page_bytes - page_size:
+                cut = _utf8_boundary(line, start + page_bytes - page_size)
+                if cut <= start:
+                    cut = start + page_bytes - page_size
+                pos += cut - start
+                start = cut
+                offsets.append(pos)
+                page_lines.append(line_no)
+                page_size = 0
+
+            page_size += len(line) - start
+            pos += len(line) - start
+            line_no += 1
+
+    offsets.append(pos)
+    return offsets, page_lines, line_no
+
+
+def pack_index(values):
+    return values.tobytes()
+
+
+def unpack_offsets(data):
+    offsets = array('Q')
+    offsets.frombytes(data)
+    return offsets
+
+
+def unpack_lines(data):
+    lines = array('I')
+    lines.frombytes(data)
+    return lines
+
+
+def read_pages(file_path, offsets, start, count):
+    """读取第 start 页（从 0 开始）起的 count 页，只做一次 seek 和一次 read"""
+    end = min(start + count, len(offsets) - 1)
+    if start >= end:
+        return []
+
+    with open(file_path, 'rb') as f:
+        f.seek(offsets[start])
+        data = f.read(offsets[end] - offsets[start])
+
+    base = offsets[start]
+    return [
+        data[offsets[n] - base:offsets[n + 1] - base].decode('utf-8', errors='replace')
+        for n in range(start, end)
+    ]
+
+
+def extract_chapters(file_path):
+    """扫描 UTF-8 文本，返回 [(章节标题, 起始字节偏移), ...]"""
+    chapters = []
+    pos = 0
+    with open(file_path, 'rb') as f:
+        for line in f:
+            # 先按字节长度粗筛，绝大多数正文行不用解码
+            if len(line) <= MAX_CHAPTER_TITLE * 4:
+                text = line.decode('utf-8', errors='replace').strip()
+                if text and len(text) <= MAX_CHAPTER_TITLE and CHAPTER_PATTERN.match(text):
+                    chapters.append((text, pos))
+            pos += len(line)
+    return chapters
+
+
+def read_range(file_path, start, end):
+    """读取 [start, end) 字节范围内的文本"""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start).decode('utf-8', errors='replace')
@@ -0,0 +1,106 @@
+"""可续传的分块上传
+
+客户端先创建上传会话，再按序号 PUT 各块（附带 SHA-256 校验），每块直接写入
+blob 存储临时目录下的 .part 文件的对应偏移处；连接中断后查询已接收的偏移量即可
+从断点继续。全部接收后 complete，文件改名移入 blob 存储，不会再复制一遍。
+"""
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from .models import db, UploadSession
+from . import storage
+
+# 每块的大小
+CHUNK_BYTES = 8 * 1024 * 1024
+# 单个文件的大小上限
+MAX_UPLOAD_BYTES = 4 * 1024 * 1024 * 1024
+# 超过这个时间没有新分块的会话视为放弃，连同临时文件一起清理
+SESSION_TTL = timedelta(days=2)
+READ_CHUNK = 64 * 1024
+
+
+def part_path(upload_id):
+    return storage.temp_path(f'{upload_id}.part')
+
+
+def expire_sessions():
+    """清理过期的上传会话"""
+    cutoff = datetime.utcnow() - SESSION_TTL
+    for upload in UploadSession.query.filter(UploadSession.updated_at < cutoff).all():
+        discard(upload)
+
+
+def create_session(kind, filename, file_ext, total_size, sha256=None, params=None):
+    """新建上传会话；sha256 是客户端给出的整个文件的哈希，传完后用来校验
+
+    即使存储中已有相同哈希的文件也要完整上传：客户端声称的哈希不能证明它持有文件内容，
+    传完后 add_file 发现内容已存在时只保留一份。
+    """
+    upload = UploadSession(
+        id=uuid.uuid4().hex,
+        kind=kind,
+        filename=filename[:255],
+        file_ext=file_ext,
+        total_size=total_size,
+        chunk_size=CHUNK_BYTES,
+        received_bytes=0,
+        sha256=sha256,
+        params=json.dumps(params or {}, ensure_ascii=False)
+    )
+    open(part_path(upload.id), 'wb').close()
+    db.session.add(upload)
+    return upload
+
+
+def append_chunk(upload, stream, length, checksum):
+    """把一块数据写到已接收部分之后，校验失败时截掉这次写入的内容并抛出 ValueError"""
+    start = upload.received_bytes
+    sha256 = hashlib.sha256()
+    with open(part_path(upload.id), 'r+b') as f:
+        f.seek(start)
+        remaining = length
+        while remaining:
+            data = stream.read(min(READ_CHUNK, remaining))
+            if not data:
+                break
+            sha256.update(data)
+            f.write(data)
+            remaining -= len(data)
+
+        error = None
+        if remaining or stream.read(1):
+            error = '分块长度不符'
+        elif sha256.hexdigest() != checksum.lower():
+            error = '分块校验失败'
+        if error:
+            f.truncate(start)
+            raise ValueError(error)
+        f.truncate(start + length)
+    upload.received_bytes = start + length
+
+
+def finish(upload, transform=None):
+    """所有分块都已接收：把文件移入 blob 存储，返回 blob 键
+
+    transform 与 storage.save_stream 相同，需要转换内容（TXT 转码）时才重新写一遍。
+    """
+    path = part_path(upload.id)
+    if upload.sha256 and storage.file_digest(path) != upload.sha256:
+        raise ValueError('文件校验失败')
+    if transform is None:
+        return storage.add_file(path, upload.file_ext, upload.sha256, upload.total_size)
+
+    with open(path, 'rb') as f:
+        key = storage.save_stream(f, upload.file_ext, transform)
+    os.remove(path)
+    return key
+
+
+def discard(upload):
+    path = part_path(upload.id)
+    if os.path.exists(path):
+        os.remove(path)
+    db.session.delete(upload)
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.models import db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """只带数据库和 blob 存储配置的最小应用，不导入 backend.app（不会启动后台任务）"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'test.db'}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['BLOB_FOLDER'] = str(tmp_path / 'blobs')
+    os.makedirs(app.config['BLOB_FOLDER'])
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
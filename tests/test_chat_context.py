@@ -0,0 +1,59 @@
+from backend import chat_context, qwen_client
+from backend.models import db, Conversation, Message
+
+
+def _conversation(count, content='消息内容'):
+    conv = Conversation(title='对话')
+    db.session.add(conv)
+    db.session.flush()
+    db.session.add_all(Message(conversation_id=conv.id, role='user' if i % 2 == 0 else 'ai',
+                               content=f'{content}{i}') for i in range(count))
+    db.session.commit()
+    return conv
+
+
+def _record_prompts(monkeypatch):
+    prompts = []
+
+    def chat(api_key, payload):
+        prompts.append(payload['messages'][-1]['content'])
+        return f'摘要{len(prompts)}'
+
+    monkeypatch.setattr(qwen_client, 'chat', chat)
+    return prompts
+
+
+def test_fold_starts_from_oldest_unread_message(app, monkeypatch):
+    prompts = _record_prompts(monkeypatch)
+    monkeypatch.setattr(chat_context, 'MAX_HISTORY_MESSAGES', 20)
+    monkeypatch.setattr(chat_context, 'SUMMARY_INPUT_TOKENS', 60)
+    monkeypatch.setattr(chat_context, 'MAX_SUMMARY_CALLS', 100)
+    conv = _conversation(50)
+    ids = [row.id for row in Message.query.order_by(Message.id)]
+
+    messages = chat_context.build(conv, api_key='key', budget=80)
+
+    # 最早的 30 条不在最近 20 条的读取范围内，也按顺序进入了摘要
+    folded = '\n'.join(prompts)
+    assert '消息内容0\n' in folded
+    positions = [folded.index(f'：消息内容{i}\n') for i in range(0, 30)]
+    assert positions == sorted(positions)
+    assert conv.summary_message_id > ids[29]
+    assert messages[0]['role'] == 'system'
+    assert messages[-1]['content'] == '消息内容49'
+
+
+def test_fold_catches_up_over_several_requests(app, monkeypatch):
+    prompts = _record_prompts(monkeypatch)
+    monkeypatch.setattr(chat_context, 'MAX_HISTORY_MESSAGES', 20)
+    monkeypatch.setattr(chat_context, 'SUMMARY_INPUT_TOKENS', 60)
+    monkeypatch.setattr(chat_context, 'MAX_SUMMARY_CALLS', 2)
+    conv = _conversation(50)
+
+    chat_context.build(conv, api_key='key', budget=80)
+    assert len(prompts) == 2
+    first = conv.summary_message_id
+    chat_context.build(conv, api_key='key', budget=80)
+    assert conv.summary_message_id > first
+    # 每批接着上一批摘要到的位置继续
+    assert f'已有摘要：\n摘要2' in prompts[2]
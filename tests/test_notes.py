@@ -0,0 +1,28 @@
+import base64
+import io
+
+from PIL import Image
+
+from backend import notes, storage
+
+
+def _data_uri(image, format_name='PNG'):
+    buffer = io.BytesIO()
+    image.save(buffer, format_name)
+    return f'data:image/{format_name.lower()};base64,{base64.b64encode(buffer.getvalue()).decode("ascii")}'
+
+
+def test_inline_image_is_moved_to_blob_store(app):
+    app.config['KEEP_ORIGINAL_IMAGES'] = False
+    text, count = notes.extract_inline_images(f'![图]({_data_uri(Image.new("RGB", (8, 8), "red"))})')
+    assert count == 1
+    keys = storage.keys_in_text(text)
+    assert len(keys) == 1 and next(iter(keys)).endswith('.webp')
+
+
+def test_decompression_bomb_is_left_untouched(app):
+    app.config['KEEP_ORIGINAL_IMAGES'] = False
+    # 压缩后只有几十 KB，解码后是 2 亿像素
+    bomb = _data_uri(Image.new('1', (20000, 10000)))
+    text = f'开头\n![图]({bomb})\n'
+    assert notes.extract_inline_images(text) == (text, 0)
@@ -0,0 +1,211 @@
+import json
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from backend import qwen_client
+
+OK_BODY = {'choices': [{'message': {'content': '你好'}}]}
+
+
+class StubServer:
+    """本地 HTTP 服务，按顺序返回预设的响应：(状态码, 响应头, 响应体[, 延迟秒数])
+
+    响应体为 bytes 时原样发送（如 SSE），否则编码为 JSON。
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                stub.requests += 1
+                status, headers, body, *delay = stub.responses.pop(0) if stub.responses else (200, {}, OK_BODY)
+                if delay:
+                    threading.Event().wait(delay[0])
+                data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}/v1/chat/completions'
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = StubServer()
+    monkeypatch.setattr(qwen_client, 'QWEN_API_URL', server.url)
+    monkeypatch.setattr(qwen_client, 'breaker', qwen_client.CircuitBreaker())
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """记录重试前的等待时长，不真正等待"""
+    waits = []
+    monkeypatch.setattr(qwen_client, 'time', types.SimpleNamespace(sleep=waits.append, monotonic=time.monotonic))
+    return waits
+
+
+def test_429_waits_for_retry_after(stub, sleeps):
+    stub.responses = [(429, {'Retry-After': '3'}, {'error': 'rate limited'})]
+    assert qwen_client.chat('key', {'model': 'qwen-turbo'}) == '你好'
+    assert stub.requests == 2
+    assert sleeps == [3.0]
+
+
+def test_retry_after_is_capped(stub, sleeps):
+    stub.responses = [(429, {'Retry-After': '3600'}, {})]
+    assert qwen_client.post_chat('key', {}).status_code == 200
+    assert sleeps == [qwen_client.MAX_RETRY_WAIT]
+
+
+def test_5xx_is_retried(stub, sleeps):
+    stub.responses = [(503, {}, {}), (502, {}, {})]
+    assert qwen_client.chat('key', {}) == '你好'
+    assert stub.requests == 3
+    assert len(sleeps) == 2
+    assert not qwen_client.breaker.is_open
+
+
+def test_5xx_returned_after_retries_exhausted(stub, sleeps):
+    stub.responses = [(500, {}, {})] * (qwen_client.MAX_RETRIES + 1)
+    assert qwen_client.post_chat('key', {}).status_code == 500
+    assert stub.requests == qwen_client.MAX_RETRIES + 1
+    stub.responses = [(500, {}, {})] * (qwen_client.MAX_RETRIES + 1)
+    with pytest.raises(qwen_client.QwenAPIError):
+        qwen_client.chat('key', {})
+
+
+def test_4xx_is_not_retried(stub, sleeps):
+    stub.responses = [(401, {}, {'error': 'invalid api key'})]
+    assert qwen_client.post_chat('key', {}).status_code == 401
+    assert stub.requests == 1
+    assert sleeps == []
+
+
+def test_read_timeout_is_not_retried(stub, sleeps, monkeypatch):
+    monkeypatch.setattr(qwen_client, 'READ_TIMEOUT', 0.2)
+    stub.responses = [(200, {}, OK_BODY, 1)]
+    with pytest.raises(requests.ReadTimeout):
+        qwen_client.post_chat('key', {})
+    assert stub.requests == 1
+    assert sleeps == []
+
+
+def test_breaker_opens_after_threshold(stub, sleeps, monkeypatch):
+    monkeypatch.setattr(qwen_client, 'MAX_RETRIES', 0)
+    stub.responses = [(500, {}, {})] * qwen_client.BREAKER_THRESHOLD
+    for _ in range(qwen_client.BREAKER_THRESHOLD - 1):
+        qwen_client.post_chat('key', {})
+        assert not qwen_client.breaker.is_open
+    qwen_client.post_chat('key', {})
+    assert qwen_client.breaker.is_open
+
+    # 熔断期间不再发出请求
+    with pytest.raises(qwen_client.CircuitOpenError):
+        qwen_client.post_chat('key', {})
+    assert stub.requests == qwen_client.BREAKER_THRESHOLD
+
+
+def test_breaker_recovers_after_single_probe(stub, sleeps, monkeypatch):
+    monkeypatch.setattr(qwen_client, 'MAX_RETRIES', 0)
+    breaker = qwen_client.CircuitBreaker(threshold=1, reset_seconds=0.1)
+    monkeypatch.setattr(qwen_client, 'breaker', breaker)
+    stub.responses = [(500, {}, {}), (200, {}, OK_BODY, 0.3)]
+    qwen_client.post_chat('key', {})
+    assert breaker.is_open
+    with pytest.raises(qwen_client.CircuitOpenError):
+        qwen_client.post_chat('key', {})
+
+    # 熔断到期后只放行一个试探请求，试探进行中的其他请求仍被拒绝
+    breaker._opened_at -= 1
+    probe = threading.Thread(target=qwen_client.post_chat, args=('key', {}))
+    probe.start()
+    while stub.requests < 2:
+        threading.Event().wait(0.01)
+    with pytest.raises(qwen_client.CircuitOpenError):
+        qwen_client.post_chat('key', {})
+    probe.join()
+    assert not breaker.is_open
+
+    assert qwen_client.chat('key', {}) == '你好'
+    assert stub.requests == 3
+
+
+def test_failed_probe_reopens_breaker(stub, sleeps, monkeypatch):
+    monkeypatch.setattr(qwen_client, 'MAX_RETRIES', 0)
+    breaker = qwen_client.CircuitBreaker(threshold=1, reset_seconds=0.1)
+    monkeypatch.setattr(qwen_client, 'breaker', breaker)
+    stub.responses = [(500, {}, {}), (500, {}, {})]
+    qwen_client.post_chat('key', {})
+    breaker._opened_at -= 1
+    qwen_client.post_chat('key', {})
+    assert stub.requests == 2
+    with pytest.raises(qwen_client.CircuitOpenError):
+        qwen_client.post_chat('key', {})
+
+
+def test_probe_released_after_invalid_request(stub, sleeps, monkeypatch):
+    monkeypatch.setattr(qwen_client, 'MAX_RETRIES', 0)
+    breaker = qwen_client.CircuitBreaker(threshold=1, reset_seconds=0.1)
+    monkeypatch.setattr(qwen_client, 'breaker', breaker)
+    stub.responses = [(500, {}, {})]
+    qwen_client.post_chat('key', {})
+    breaker._opened_at -= 1
+
+    # 试探请求在发出前就失败（API Key 中有换行，请求头无效），不能让熔断一直保持
+    with pytest.raises(requests.exceptions.InvalidHeader):
+        qwen_client.post_chat('bad\nkey', {})
+    assert qwen_client.chat('key', {}) == '你好'
+    assert not breaker.is_open
+
+
+def _sse(*chunks, done=True):
+    lines = [f'data: {json.dumps({"choices": [{"delta": {"content": c}}]})}\n\n' for c in chunks]
+    if done:
+        lines.append('data: [DONE]\n\n')
+    return ''.join(lines).encode('utf-8')
+
+
+def test_stream_deltas_until_done(stub):
+    stub.responses = [(200, {}, _sse('你', '好'))]
+    response = qwen_client.post_chat('key', {'stream': True}, stream=True)
+    assert list(qwen_client.stream_deltas(response)) == ['你', '好']
+
+
+def test_stream_cut_off_before_done_raises(stub):
+    stub.responses = [(200, {}, _sse('你', '好', done=False))]
+    response = qwen_client.post_chat('key', {'stream': True}, stream=True)
+    deltas = []
+    with pytest.raises(qwen_client.QwenAPIError):
+        for delta in qwen_client.stream_deltas(response):
+            deltas.append(delta)
+    assert deltas == ['你', '好']
@@ -0,0 +1,46 @@
+import threading
+
+from backend.response_cache import ResponseCache, make_key
+
+PAYLOAD = {'model': 'qwen-turbo', 'messages': [{'role': 'user', 'content': '你好'}], 'temperature': 0.7}
+
+
+def test_key_depends_on_api_key():
+    assert make_key('key-a', PAYLOAD) == make_key('key-a', dict(PAYLOAD))
+    assert make_key('key-a', PAYLOAD) != make_key('key-b', PAYLOAD)
+    assert 'key-a' not in make_key('key-a', PAYLOAD)
+
+
+def test_coalesced_waiters_count_as_hits():
+    cache = ResponseCache(10, 60)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return '回复'
+
+    key = make_key('key', PAYLOAD)
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.get_or_call(key, call)))
+    owner.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(cache.get_or_call(key, call))) for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    # 等其他请求都开始等待那次调用
+    threading.Event().wait(0.2)
+    release.set()
+    for thread in [owner] + waiters:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [('回复', False)] + [('回复', True)] * 3
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['coalesced']) == (3, 1, 3)
+    assert stats['hit_rate'] == 0.75
+
+    assert cache.get_or_call(key, call) == ('回复', True)
+    assert cache.stats()['hits'] == 4
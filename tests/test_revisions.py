@@ -0,0 +1,58 @@
+import os
+from datetime import timedelta
+
+from backend import notes, revisions, storage
+from backend.models import db, Note, NoteRevision
+
+
+def _add_image(tmp_path):
+    path = tmp_path / 'upload.png'
+    path.write_bytes(b'\x89PNG fake image data')
+    key = storage.add_file(str(path), 'png')
+    db.session.commit()
+    return key
+
+
+def _create_note(content):
+    note = Note(id='n1', title='备忘录', content=content)
+    db.session.add(note)
+    storage.set_refs('note', note.id, storage.keys_in_text(content))
+    db.session.commit()
+    return note
+
+
+def test_removed_image_survives_gc_while_revision_exists(app, tmp_path):
+    key = _add_image(tmp_path)
+    with_image = f'开头\n![图片]({storage.blob_url(key)})\n结尾\n'
+    note = _create_note(with_image)
+
+    # 从备忘录中删掉图片，图片只剩历史版本引用
+    assert notes.write(note, note.title, '开头\n结尾\n')
+    db.session.commit()
+
+    removed, _ = storage.collect_garbage(grace=timedelta(0))
+    assert removed == 0
+    assert os.path.exists(storage.blob_path(key))
+
+    revision = NoteRevision.query.filter_by(note_id=note.id).one()
+    content = revisions.content_of(revision, note.content)
+    assert content == with_image
+    assert notes.write(note, revision.title, content)
+    db.session.commit()
+    assert storage.keys_in_text(db.session.get(Note, 'n1').content) == {key}
+    assert storage.collect_garbage(grace=timedelta(0))[0] == 0
+    assert os.path.exists(storage.blob_path(key))
+
+
+def test_removing_revisions_releases_images(app, tmp_path):
+    key = _add_image(tmp_path)
+    note = _create_note(f'![图片]({storage.blob_url(key)})\n')
+    assert notes.write(note, note.title, '没有图片了\n')
+    db.session.commit()
+
+    revisions.remove(note.id)
+    db.session.commit()
+
+    removed, _ = storage.collect_garbage(grace=timedelta(0))
+    assert removed == 1
+    assert not os.path.exists(storage.blob_path(key))